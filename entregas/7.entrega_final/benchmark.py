@@ -0,0 +1,467 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from so import *
+from page_replay import ReferenceTrace, replay_report
+import log
+
+
+# Scheduling algorithms the benchmark can run, by name
+SCHEDULERS = {
+    "fcfs": lambda kernel, quantum: FirstComeFirstServed(kernel),
+    "rr": lambda kernel, quantum: RoundRobin(kernel, quantum),
+    "priority": lambda kernel, quantum: Priority(kernel, False),
+    "priority_preemptive": lambda kernel, quantum: Priority(kernel, True),
+    "cfs": lambda kernel, quantum: CompletelyFairScheduler(kernel),
+    "lottery": lambda kernel, quantum: LotteryScheduler(kernel, quantum),
+    "mlfq": lambda kernel, quantum: MultilevelFeedbackQueue(kernel, (quantum, 2 * quantum, 4 * quantum)),
+    "stride": lambda kernel, quantum: StrideScheduler(kernel, quantum),
+    "sjf": lambda kernel, quantum: ShortestJobFirst(kernel),
+    "srtf": lambda kernel, quantum: ShortestRemainingTimeFirst(kernel),
+}
+
+# Page replacement algorithms for pagination on demand, by name
+REPLACEMENTS = {
+    "fifo": lambda memory_manager, window: FIFOPageReplacementAlgorithm(memory_manager),
+    "lru": lambda memory_manager, window: LRUPageReplacementAlgorithm(memory_manager),
+    "second_chance": lambda memory_manager, window: SecondChanceReplacementAlgorithm(memory_manager),
+    "ws": lambda memory_manager, window: WorkingSetReplacementAlgorithm(memory_manager, window),
+    "wsclock": lambda memory_manager, window: WSClockReplacementAlgorithm(memory_manager, window),
+}
+
+
+# describes a synthetic workload: how many programs, how they look and on which machine they run
+class Workload:
+
+    def __init__(self, name, programs=10, length=100, io_ratio=0.1, frame_size=4, memory_factor=None,
+                 scheduler="fcfs", quantum=4, on_demand=False, event_driven=False, seed=0, swap_factor=None,
+                 tlb_size=0, tlb_associativity=None, tlb_policy="lru", tlb_tagged=False,
+                 replacement="second_chance", window=50, replay=False, read_ahead=0, prefetch_cap=16,
+                 page_table_levels=1, instances=1, share_pages=True, pageout_watermark=0, pageout_batch=4,
+                 discard_clean_pages=True):
+        self._name = name
+        self._programs = programs
+        self._length = length
+        self._io_ratio = io_ratio
+        self._frame_size = frame_size
+        self._memory_factor = memory_factor
+        self._scheduler = scheduler
+        self._quantum = quantum
+        self._on_demand = on_demand
+        self._event_driven = event_driven
+        self._seed = seed
+        self._swap_factor = swap_factor
+        self._tlb_size = tlb_size
+        self._tlb_associativity = tlb_associativity
+        self._tlb_policy = tlb_policy
+        self._tlb_tagged = tlb_tagged
+        self._replacement = replacement
+        self._window = window
+        self._replay = replay
+        self._read_ahead = read_ahead
+        self._prefetch_cap = prefetch_cap
+        self._page_table_levels = page_table_levels
+        self._instances = instances
+        self._share_pages = share_pages
+        self._pageout_watermark = pageout_watermark
+        self._pageout_batch = pageout_batch
+        self._discard_clean_pages = discard_clean_pages
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def frame_size(self):
+        return self._frame_size
+
+    @property
+    def scheduler(self):
+        return self._scheduler
+
+    @property
+    def quantum(self):
+        return self._quantum
+
+    @property
+    def on_demand(self):
+        return self._on_demand
+
+    @property
+    def replacement(self):
+        return self._replacement
+
+    @property
+    def window(self):
+        return self._window
+
+    # records the page references to replay them with every replacement algorithm (on demand)
+    @property
+    def replay(self):
+        return self._replay
+
+    @property
+    def read_ahead(self):
+        return self._read_ahead
+
+    @property
+    def prefetch_cap(self):
+        return self._prefetch_cap
+
+    @property
+    def page_table_levels(self):
+        return self._page_table_levels
+
+    # processes running each program
+    @property
+    def instances(self):
+        return self._instances
+
+    @property
+    def share_pages(self):
+        return self._share_pages
+
+    # free frames kept by the background pageout (0: no pageout)
+    @property
+    def pageout_watermark(self):
+        return self._pageout_watermark
+
+    @property
+    def pageout_batch(self):
+        return self._pageout_batch
+
+    @property
+    def discard_clean_pages(self):
+        return self._discard_clean_pages
+
+    @property
+    def event_driven(self):
+        return self._event_driven
+
+    @property
+    def seed(self):
+        return self._seed
+
+    # pages of a single program (its EXIT included)
+    def program_pages(self):
+        return -(-(self._length + 1) // self._frame_size)
+
+    # without an explicit memory factor every process fits in memory (and in swap)
+    @property
+    def memory_factor(self):
+        if self._memory_factor is None:
+            return self._programs * self._instances * self.program_pages()
+        return self._memory_factor
+
+    # without an explicit swap factor every process fits in swap
+    @property
+    def swap_factor(self):
+        if self._swap_factor is None:
+            return self._programs * self._instances * self.program_pages()
+        return self._swap_factor
+
+    # a new TLB for each run, None without TLB
+    def create_tlb(self):
+        if self._tlb_size == 0:
+            return None
+        return TLB(self._tlb_size, self._tlb_associativity, self._tlb_policy, self._tlb_tagged, self._seed)
+
+    def create_programs(self):
+        generator = random.Random(self._seed)
+        programs = []
+        for index in range(0, self._programs):
+            instructions = []
+            for i in range(0, self._length):
+                if generator.random() < self._io_ratio:
+                    instructions.append(ASM.IO())
+                else:
+                    instructions.append(ASM.CPU(1))
+            programs.append(Program("prg{index}.exe".format(index=index), instructions))
+        return programs
+
+    def parameters(self):
+        return {"programs": self._programs, "length": self._length, "io_ratio": self._io_ratio,
+                "frame_size": self.frame_size, "memory_factor": self.memory_factor, "swap_factor": self.swap_factor,
+                "scheduler": self.scheduler, "quantum": self.quantum, "on_demand": self.on_demand,
+                "event_driven": self.event_driven, "seed": self.seed, "tlb_size": self._tlb_size,
+                "tlb_associativity": self._tlb_associativity, "tlb_policy": self._tlb_policy,
+                "tlb_tagged": self._tlb_tagged, "replacement": self.replacement,
+                "window": self.window, "replay": self.replay,
+                "read_ahead": self.read_ahead, "prefetch_cap": self.prefetch_cap,
+                "page_table_levels": self.page_table_levels, "instances": self.instances,
+                "share_pages": self.share_pages, "pageout_watermark": self.pageout_watermark,
+                "pageout_batch": self.pageout_batch, "discard_clean_pages": self.discard_clean_pages}
+
+
+# Runs a workload headlessly until every program has finished and returns its measures
+def run(workload, max_ticks=10000000):
+    random.seed(workload.seed)
+    kernel = Kernel(workload.frame_size, workload.memory_factor, None, workload.event_driven, workload.on_demand,
+                    workload.swap_factor, tlb=workload.create_tlb(), page_table_levels=workload.page_table_levels)
+    kernel.scheduler = SCHEDULERS[workload.scheduler](kernel, workload.quantum)
+    kernel.memory_manager.share_pages = workload.share_pages
+    if workload.on_demand:
+        memory_manager = kernel.memory_manager
+        memory_manager.victim_selector = REPLACEMENTS[workload.replacement](memory_manager, workload.window)
+        memory_manager.read_ahead = workload.read_ahead
+        memory_manager.prefetch_cap = workload.prefetch_cap
+        memory_manager.discard_clean_pages = workload.discard_clean_pages
+        if workload.pageout_watermark > 0:
+            memory_manager.start_pageout(workload.pageout_watermark, workload.pageout_batch)
+    programs = workload.create_programs()
+    for program in programs:
+        HARDWARE.addProgram(program)
+    trace = None
+    if workload.replay and workload.on_demand:
+        trace = ReferenceTrace()
+        trace.attach()
+    start = time.perf_counter()
+    for instance in range(0, workload.instances):
+        for program in programs:
+            kernel.execute(program.name)
+    clock = HARDWARE.clock
+    # both clocks stop on the same condition, so ticks and irqs are comparable
+    running = lambda: (kernel.has_running() or not kernel.has_finished()) and clock.tickNbr < max_ticks
+    if workload.event_driven:
+        clock.run_while(running)
+    else:
+        while running():
+            clock.tick()
+    elapsed = time.perf_counter() - start
+    result = measures(workload, kernel, elapsed)
+    if trace is not None:
+        trace.detach()
+        result["replay"] = replay(workload, trace)
+    return result
+
+
+# Faults of the optimal replacement and of every replacement algorithm for the references of the run
+def replay(workload, trace):
+    factories = {name: (lambda memory_manager, factory=factory: factory(memory_manager, workload.window))
+                 for name, factory in REPLACEMENTS.items()}
+    return replay_report(trace, workload.memory_factor, factories)
+
+
+def measures(workload, kernel, elapsed):
+    ticks = HARDWARE.clock.tickNbr
+    instructions = HARDWARE.cpu.executed
+    irqs = HARDWARE.interruptVector.counts
+    page_faults = irqs.get(PAGE_FAULT_INTERRUPTION_TYPE, 0)
+    tlb = HARDWARE.mmu.tlb
+    victims = getattr(kernel.memory_manager, "evictions", 0)
+    victim_selector = getattr(kernel.memory_manager, "victim_selector", None)
+    page_tables = kernel.memory_manager.page_table_footprint()
+    return {
+        "workload": workload.name,
+        "parameters": workload.parameters(),
+        "finished": all(pcb.state == "Terminated" for pcb in kernel.table.elements),
+        "elapsed_seconds": elapsed,
+        "ticks": ticks,
+        "ticks_per_second": ticks / elapsed,
+        "instructions": instructions,
+        "instructions_per_second": instructions / elapsed,
+        "irqs": HARDWARE.interruptVector.handled,
+        "irqs_per_second": HARDWARE.interruptVector.handled / elapsed,
+        "irqs_by_type": dict(irqs),
+        "page_faults": page_faults,
+        "page_faults_per_second": page_faults / elapsed,
+        "victims": victims,
+        "victims_per_second": victims / elapsed,
+        "working_sets": victim_selector.stats() if victim_selector is not None else None,
+        "prefetch": kernel.memory_manager.prefetch_stats() if victim_selector is not None else None,
+        "pageout": kernel.memory_manager.pageout_stats() if victim_selector is not None else None,
+        "tlb": tlb.stats() if tlb is not None else None,
+        "sharing": kernel.memory_manager.sharing_stats(),
+        "scheduling": scheduling_stats(kernel),
+        "page_tables": {"bytes": sum(table["bytes"] for table in page_tables.values()),
+                        "peak_bytes": sum(table["peak_bytes"] for table in page_tables.values()),
+                        "per_process": page_tables},
+    }
+
+
+# mean ticks of the processes in the ready queue and from their arrival to their end (of the finished ones)
+def scheduling_stats(kernel):
+    pcbs = kernel.table.elements
+    finished = [pcb for pcb in pcbs if pcb.state == "Terminated"]
+    return {"mean_waiting_ticks": sum(pcb.waiting_ticks for pcb in pcbs) / len(pcbs) if pcbs else 0,
+            "mean_turnaround_ticks": sum(pcb.state_tick - pcb.arrival_tick for pcb in finished) / len(finished)
+            if finished else 0}
+
+
+# the default suite: a CPU bound and an I/O bound mix for every scheduler, eager and on demand
+# (with plenty of memory and under memory pressure)
+def default_suite():
+    suite = []
+    for scheduler in sorted(SCHEDULERS.keys()):
+        for mix, io_ratio in [("cpu", 0.02), ("io", 0.3)]:
+            suite.append(Workload("{s}-{mix}-eager".format(s=scheduler, mix=mix),
+                                  programs=20, length=200, io_ratio=io_ratio, scheduler=scheduler))
+            suite.append(Workload("{s}-{mix}-on-demand".format(s=scheduler, mix=mix),
+                                  programs=20, length=200, io_ratio=io_ratio, scheduler=scheduler,
+                                  on_demand=True, memory_factor=500))
+            suite.append(Workload("{s}-{mix}-on-demand-pressure".format(s=scheduler, mix=mix),
+                                  programs=20, length=200, io_ratio=io_ratio, scheduler=scheduler,
+                                  on_demand=True, memory_factor=20))
+    # every page replacement algorithm with many programs sharing a small memory
+    for replacement in sorted(REPLACEMENTS.keys()):
+        suite.append(Workload("rr-io-thrashing-{r}".format(r=replacement),
+                              programs=20, length=200, io_ratio=0.3, scheduler="rr", on_demand=True,
+                              memory_factor=12, replacement=replacement))
+    # the same thrashing with the victims evicted in the background
+    suite.append(Workload("rr-io-thrashing-pageout", programs=20, length=200, io_ratio=0.3, scheduler="rr",
+                          on_demand=True, memory_factor=12, pageout_watermark=3, pageout_batch=2))
+    # many processes running the same programs, with and without sharing their pages
+    for sharing, share_pages in [("shared", True), ("private", False)]:
+        suite.append(Workload("rr-io-instances-{s}".format(s=sharing),
+                              programs=5, length=200, io_ratio=0.3, scheduler="rr", on_demand=True,
+                              memory_factor=60, instances=4, share_pages=share_pages))
+    return suite
+
+
+# Runs a CPU bound program headlessly and returns the mean cost of a tick (in microseconds)
+def tick_cost(ticks):
+    kernel = Kernel(4, ticks // 4 + 4, None)
+    HARDWARE.addProgram(Program("bench.exe", [ASM.CPU(ticks + 3)]))
+    kernel.execute("bench.exe")
+    start = time.perf_counter()
+    HARDWARE.clock.do_ticks(ticks)
+    return (time.perf_counter() - start) / ticks * 1000000
+
+
+# Compares the cost of a tick with the logging on (written to /dev/null) and off (quiet mode)
+def log_overhead(ticks=2000):
+    with open(os.devnull, "w") as devnull:
+        log.setup_logger(devnull)
+        log.set_quiet(False)
+        on = tick_cost(ticks)
+        log.set_quiet(True)
+        off = tick_cost(ticks)
+    log.set_quiet(False)
+    log.logger.setLevel(logging.WARNING)
+    log.refresh()
+    return {"logging_on_us_per_tick": on, "logging_off_us_per_tick": off}
+
+
+# Mean cost of a dispatch (next and add back, in microseconds) of every scheduler with ready_processes waiting
+def scheduler_overhead(ready_processes, dispatches=20000):
+    costs = {}
+    for name, factory in sorted(SCHEDULERS.items()):
+        random.seed(0)
+        kernel = Kernel(4, 4, None)
+        scheduler = factory(kernel, 4)
+        for pid in range(0, ready_processes):
+            pcb = PCB("bench.exe")
+            pcb.set_pid(pid)
+            scheduler.add(pcb)
+        start = time.perf_counter()
+        for dispatch in range(0, dispatches):
+            scheduler.add(scheduler.next())
+        costs[name] = (time.perf_counter() - start) / dispatches * 1000000
+    return {"ready_processes": ready_processes, "us_per_dispatch": costs}
+
+
+# Compares two benchmark results by workload, a workload is a regression when it runs
+# less ticks per second than the baseline (beyond the tolerance)
+def compare(baseline, results, tolerance=0.1):
+    previous = {result["workload"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        old = previous.get(result["workload"])
+        if old is not None:
+            ratio = result["ticks_per_second"] / old["ticks_per_second"]
+            # stderr: the results may be going to stdout
+            print("{name:40} {old:12.0f} -> {new:12.0f} ticks/s ({ratio:.2f}x)"
+                  .format(name=result["workload"], old=old["ticks_per_second"],
+                          new=result["ticks_per_second"], ratio=ratio), file=sys.stderr)
+            if ratio < 1 - tolerance:
+                regressions.append(result["workload"])
+    return regressions
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Emulator benchmark (runs the default suite without --programs)")
+    parser.add_argument("--programs", type=int, help="number of programs of a single workload")
+    parser.add_argument("--length", type=int, default=100, help="instructions per program")
+    parser.add_argument("--io-ratio", type=float, default=0.1, help="fraction of IO instructions")
+    parser.add_argument("--frame-size", type=int, default=4)
+    parser.add_argument("--memory-factor", type=int, help="frames of memory (default: every program fits)")
+    parser.add_argument("--swap-factor", type=int, help="frames of swap (default: every program fits)")
+    parser.add_argument("--scheduler", choices=sorted(SCHEDULERS.keys()), default="fcfs")
+    parser.add_argument("--quantum", type=int, default=4)
+    parser.add_argument("--on-demand", action="store_true", help="pagination on demand")
+    parser.add_argument("--event-driven", action="store_true", help="discrete event clock")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tlb-size", type=int, default=0, help="TLB entries (default: no TLB)")
+    parser.add_argument("--tlb-associativity", type=int, help="TLB ways (default: fully associative)")
+    parser.add_argument("--tlb-policy", choices=["lru", "random"], default="lru")
+    parser.add_argument("--tlb-tagged", action="store_true", help="ASID tagged TLB instead of flushing it")
+    parser.add_argument("--replacement", choices=sorted(REPLACEMENTS.keys()), default="second_chance",
+                        help="page replacement algorithm (pagination on demand)")
+    parser.add_argument("--window", type=int, default=50, help="working set window in ticks (ws and wsclock)")
+    parser.add_argument("--read-ahead", type=int, default=0, help="max pages read ahead on a page fault")
+    parser.add_argument("--prefetch-cap", type=int, default=16, help="max frames of prefetched pages not used yet")
+    parser.add_argument("--page-table-levels", type=int, choices=[1, 2, 3], default=1,
+                        help="flat (1) or multi level page tables")
+    parser.add_argument("--instances", type=int, default=1, help="processes running each program")
+    parser.add_argument("--no-share-pages", action="store_true",
+                        help="every process loads its own copy of the pages of its program")
+    parser.add_argument("--pageout-watermark", type=int, default=0,
+                        help="free frames kept by evicting in the background (default: no pageout)")
+    parser.add_argument("--pageout-batch", type=int, default=4, help="max victims evicted by the pageout per tick")
+    parser.add_argument("--write-back-clean", action="store_true",
+                        help="write the clean victims to swap instead of dropping them")
+    parser.add_argument("--replay", action="store_true",
+                        help="replay the page references with the optimal and every replacement algorithm")
+    parser.add_argument("--log-overhead", action="store_true", help="only measure the cost of logging")
+    parser.add_argument("--scheduler-overhead", type=int, metavar="READY",
+                        help="only measure the cost of a dispatch with READY processes waiting")
+    parser.add_argument("--output", help="JSON file for the results (default: stdout)")
+    parser.add_argument("--compare", help="JSON file of a previous run, exits with 1 on regressions")
+    return parser.parse_args()
+
+
+#
+#  MAIN
+#
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    if arguments.log_overhead:
+        results = log_overhead()
+    elif arguments.scheduler_overhead is not None:
+        results = scheduler_overhead(arguments.scheduler_overhead)
+    else:
+        if arguments.programs is None:
+            workloads = default_suite()
+        else:
+            workloads = [Workload("custom", programs=arguments.programs, length=arguments.length,
+                                  io_ratio=arguments.io_ratio, frame_size=arguments.frame_size,
+                                  memory_factor=arguments.memory_factor, scheduler=arguments.scheduler,
+                                  quantum=arguments.quantum, on_demand=arguments.on_demand,
+                                  event_driven=arguments.event_driven, seed=arguments.seed,
+                                  swap_factor=arguments.swap_factor, tlb_size=arguments.tlb_size,
+                                  tlb_associativity=arguments.tlb_associativity, tlb_policy=arguments.tlb_policy,
+                                  tlb_tagged=arguments.tlb_tagged, replacement=arguments.replacement,
+                                  window=arguments.window, replay=arguments.replay,
+                                  read_ahead=arguments.read_ahead, prefetch_cap=arguments.prefetch_cap,
+                                  page_table_levels=arguments.page_table_levels, instances=arguments.instances,
+                                  share_pages=not arguments.no_share_pages,
+                                  pageout_watermark=arguments.pageout_watermark,
+                                  pageout_batch=arguments.pageout_batch,
+                                  discard_clean_pages=not arguments.write_back_clean)]
+        results = {"results": [run(workload) for workload in workloads]}
+    if arguments.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(arguments.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if arguments.compare is not None:
+        with open(arguments.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results)
+        if regressions:
+            print("Regressions: {names}".format(names=", ".join(regressions)), file=sys.stderr)
+            raise SystemExit(1)
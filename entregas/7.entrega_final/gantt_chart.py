@@ -38,9 +38,22 @@ class GanttChartCalculator:
                 else:
                     self.chart[pcb.pid] = self.initiate_chart()
                     self.chart[pcb.pid] = self.chart[pcb.pid] + self.get_symbol(pcb.state)
-        log.logger.info(self)
+        if log.enabled:
+            log.logger.info("%s", self)
         self.ticks = self.ticks + 1
 
+    # the chart only records what happens, it never schedules an event
+    def next_event(self, tickNbr):
+        return None
+
+    # while the clock skips idle ticks no pcb changes its state
+    def skip(self, ticks):
+        for pcb in self.kernel.table.elements:
+            if pcb.pid not in self.chart:
+                self.chart[pcb.pid] = self.initiate_chart()
+            self.chart[pcb.pid] = self.chart[pcb.pid] + self.get_symbol(pcb.state) * ticks
+        self.ticks = self.ticks + ticks
+
     def get_symbol(self,  state):
         if state == "Running":
             return " R "
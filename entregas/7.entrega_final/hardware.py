@@ -1,13 +1,28 @@
 #!/usr/bin/env python
 
+from array import array
+from collections import OrderedDict
 from tabulate import tabulate
+import json
+import mmap
+import os
+import random
 from time import sleep
+from heapq import heappush, heappop
 import log
 
 ##  Estas son la instrucciones soportadas por nuestro CPU
-INSTRUCTION_IO = 'IO'
-INSTRUCTION_CPU = 'CPU'
-INSTRUCTION_EXIT = 'EXIT'
+##  Each instruction is encoded as a one byte opcode, 0 is an empty cell
+INSTRUCTION_EMPTY = 0
+INSTRUCTION_CPU = 1
+INSTRUCTION_IO = 2
+INSTRUCTION_EXIT = 3
+
+##  Text of each opcode, only used for display
+INSTRUCTION_NAMES = ('', 'CPU', 'IO', 'EXIT')
+
+##  Typecode of the arrays that store instructions (unsigned char)
+INSTRUCTION_TYPECODE = 'B'
 
 
 ## Helper for emulated machine code
@@ -33,6 +48,18 @@ class ASM():
     def isIO(self, instruction):
         return INSTRUCTION_IO == instruction
 
+    @classmethod
+    def name(self, instruction):
+        return INSTRUCTION_NAMES[instruction]
+
+    @classmethod
+    def names(self, instructions):
+        return [INSTRUCTION_NAMES[instruction] for instruction in instructions]
+
+    @classmethod
+    def encode(self, instructions):
+        return array(INSTRUCTION_TYPECODE, instructions)
+
 
 ##  Estas son la interrupciones soportadas por nuestro Kernel
 KILL_INTERRUPTION_TYPE = "#KILL"
@@ -64,23 +91,44 @@ class InterruptVector():
 
     def __init__(self):
         self._handlers = dict()
+        self._handled = 0
+        self._counts = dict()
+
+    ## number of irqs handled since the hardware was set up
+    @property
+    def handled(self):
+        return self._handled
+
+    ## number of irqs handled by type
+    @property
+    def counts(self):
+        return self._counts
 
     def register(self, interruptionType, interruptionHandler):
         self._handlers[interruptionType] = interruptionHandler
 
     def handle(self, irq):
-        log.logger.info("Handling {type} irq with parameters = {parameters}"
-                        .format(type=irq.type, parameters=irq.parameters ))
+        if log.enabled:
+            parameters = irq.parameters
+            ## the IO irq carries the opcode of the instruction, it is shown by its text
+            if irq.type == IO_IN_INTERRUPTION_TYPE:
+                parameters = ASM.name(parameters)
+            log.logger.info("Handling %s irq with parameters = %s", irq.type, parameters)
+        self._handled += 1
+        self._counts[irq.type] = self._counts.get(irq.type, 0) + 1
         self._handlers[irq.type].execute(irq)
 
 
 ## emulates the Internal Clock
+## ticks_per_second throttles the clock to real time (the original behaviour was 1 tick per second),
+## None runs the clock in virtual time: tickNbr advances as fast as the subscribers allow
 class Clock():
 
-    def __init__(self):
+    def __init__(self, ticks_per_second=1):
         self._subscribers = []
         self._running = False
         self._tickNbr = 0
+        self._ticks_per_second = ticks_per_second
 
     @property
     def tickNbr(self):
@@ -90,6 +138,18 @@ class Clock():
     def tickNbr(self, value):
         self._tickNbr = value
 
+    @property
+    def ticks_per_second(self):
+        return self._ticks_per_second
+
+    @ticks_per_second.setter
+    def ticks_per_second(self, value):
+        self._ticks_per_second = value
+
+    @property
+    def is_virtual(self):
+        return self._ticks_per_second is None
+
     def addSubscriber(self, subscriber):
         self._subscribers.append(subscriber)
 
@@ -104,13 +164,18 @@ class Clock():
             self.tick()
 
     def tick(self):
-        log.logger.info("        --------------- tick: {tickNbr} ---------------".format(tickNbr=self.tickNbr))
+        if log.enabled:
+            log.logger.info("        --------------- tick: %s ---------------", self.tickNbr)
         ## notify all subscriber that a new clock cycle has started
         for subscriber in self._subscribers:
             subscriber.tick(self.tickNbr)
         self.tickNbr += 1
-        ## wait 1 second and keep looping
-        sleep(1)
+        ## in real time wait for the next tick, in virtual time keep looping
+        self.throttle()
+
+    def throttle(self, ticks=1):
+        if self._ticks_per_second is not None:
+            sleep(ticks / self._ticks_per_second)
 
     def do_ticks(self, times):
         log.logger.info("---- :::: CLOCK do_ticks: {times} ::: -----".format(times=times))
@@ -118,6 +183,97 @@ class Clock():
             self.tick()
 
 
+## emulates the Internal Clock as a discrete event simulation
+## Subscribers may implement next_event(tickNbr), the number of ticks until they have work to do
+## (0 = this tick, None = nothing until an irq changes their state), and skip(ticks), which
+## fast-forwards their passive countdowns. Subscribers without next_event are ticked every cycle.
+## The clock keeps a priority queue of the subscribers' next events and jumps straight to the
+## earliest one, so the irq sequence is the same as in the tick by tick loop.
+class EventDrivenClock(Clock):
+
+    def __init__(self, interruptVector, ticks_per_second=None):
+        super().__init__(ticks_per_second)
+        self._interruptVector = interruptVector
+        self._events = []
+        self._irqMark = None
+
+    def start(self):
+        log.logger.info("---- :::: START CLOCK  ::: -----")
+        self._running = True
+        self.tickNbr = 0
+        self.reschedule()
+        while (self._running):
+            eventTick = self.next_event_tick()
+            if eventTick is None:
+                ## nothing will ever happen again: the emulation is over
+                log.logger.info("---- :::: NO PENDING EVENTS ::: -----")
+                self.stop()
+            else:
+                self.advance(eventTick)
+
+    ## runs events while condition() holds; it is checked before every event,
+    ## just like a tick by tick loop checks it before every tick
+    def run_while(self, condition):
+        self._running = True
+        self.reschedule()
+        while self._running and condition():
+            eventTick = self.next_event_tick()
+            if eventTick is None:
+                self.stop()
+            else:
+                self.advance(eventTick)
+
+    def do_ticks(self, times):
+        log.logger.info("---- :::: CLOCK do_ticks: {times} ::: -----".format(times=times))
+        lastTick = self.tickNbr + times
+        self.reschedule()
+        while self.tickNbr < lastTick:
+            eventTick = self.next_event_tick()
+            if (eventTick is None) or (eventTick >= lastTick):
+                self.skip(lastTick - self.tickNbr)
+            else:
+                self.advance(eventTick)
+
+    ## fast-forward to eventTick and run that tick on every subscriber
+    def advance(self, eventTick):
+        self.skip(eventTick - self.tickNbr)
+        self.tick()
+        ## the events of this tick are consumed, those subscribers are asked again
+        while self._events and self._events[0][0] < self.tickNbr:
+            order = heappop(self._events)[1]
+            self.schedule(order)
+
+    def skip(self, ticks):
+        if ticks > 0:
+            for subscriber in self._subscribers:
+                subscriber.skip(ticks)
+            self.tickNbr += ticks
+            self.throttle(ticks)
+
+    def next_event_tick(self):
+        ## any irq may have changed the state of the subscribers, so their events are recomputed
+        if self._irqMark != self._interruptVector.handled:
+            self.reschedule()
+        if self._events:
+            return self._events[0][0]
+        return None
+
+    def reschedule(self):
+        self._irqMark = self._interruptVector.handled
+        self._events = []
+        for order in range(0, len(self._subscribers)):
+            self.schedule(order)
+
+    def schedule(self, order):
+        subscriber = self._subscribers[order]
+        if hasattr(subscriber, "next_event"):
+            delay = subscriber.next_event(self.tickNbr)
+        else:
+            delay = 0
+        if delay is not None:
+            heappush(self._events, (self.tickNbr + delay, order))
+
+
 class Timer:
 
     def __init__(self, interruptVector):
@@ -141,117 +297,428 @@ class Timer:
     def tick(self, tickNbr):
         if self._is_on:
             self._counter -= 1
-            log.logger.info("Counter value: " + str(self._counter))
+            if log.enabled:
+                log.logger.info("Counter value: %s", self._counter)
             if self._counter == 0:
                 log.logger.info("Process time finished")
                 timeoutIRQ = IRQ(TIME_OUT_INTERRUPTION_TYPE)
                 self._interruptVector.handle(timeoutIRQ)
 
+    ## ticks until the timer raises a TIME_OUT, None if it won't fire by itself
+    def next_event(self, tickNbr):
+        if self._is_on and self._counter > 0:
+            return self._counter - 1
+        return None
+
+    def skip(self, ticks):
+        if self._is_on:
+            self._counter -= ticks
+
     def set_on(self, value):
         self._is_on = True
         self._quantum = value
         self._counter = value
         log.logger.info("Timer is set on with quantum " + str(self._quantum) + " and counter " + str(self._counter))
 
-    def reset(self):
+    ## quantum = None keeps the current one, a scheduler may give every process its own quantum
+    def reset(self, quantum=None):
         if self._is_on:
+            if quantum is not None:
+                self._quantum = quantum
             self._counter = self._quantum - 1
-            log.logger.info("Timer reset")
+            if log.enabled:
+                log.logger.info("Timer reset")
 
     def __repr__(self):
         return "TIMER\nTimer is on: {status} \nQuantum: {quantum} \nCounter: {counter}" \
             .format(status=self.is_on, quantum=self.quantum, counter=self.counter)
 
 
-## emulates the swap memory
-class Swap:
+## emulates a storage of cells grouped in frames (main memory and swap)
+## the cells are a contiguous buffer of opcodes, whole frames are copied with memoryview slices
+class FrameStorage():
 
-    def __init__(self, size):
-        self._cells = [''] * size
+    ## cells is an optional buffer of size bytes (i.e. a memory mapped file) used instead of an array
+    def __init__(self, size, cells=None):
+        if cells is None:
+            cells = ASM.encode(bytes(size))
+        self._cells = cells
+        self._view = memoryview(self._cells)
         self._size = size
+        self._frame_size = None
+
     @property
     def size(self):
         return self._size
 
+    @property
+    def frame_size(self):
+        return self._frame_size
+
+    @frame_size.setter
+    def frame_size(self, value):
+        self._frame_size = value
+
     def put(self, addr, value):
         self._cells[addr] = value
 
     def get(self, addr):
         return self._cells[addr]
 
+    ## returns a view of the frame (no copy), it follows later writes on the frame
+    def read_frame(self, frame):
+        base = frame * self._frame_size
+        return self._view[base:base + self._frame_size]
+
+    ## copies data (a bytes-like object of at most frame_size opcodes) at the start of the frame
+    def write_frame(self, frame, data):
+        base = frame * self._frame_size
+        self._view[base:base + len(data)] = data
+
+
+## closes a memory mapped file, unless views of it are still in use: then the mapping
+## is released with the last of them
+def close_map(mapping):
+    try:
+        mapping.close()
+    except BufferError:
+        pass
+
+
+## emulates the swap memory
+class Swap(FrameStorage):
+
+    def __init__(self, size, cells=None):
+        super().__init__(size, cells)
+
+    def close(self):
+        pass
+
     def __repr__(self):
-        return "{cells}".format(cells=tabulate(enumerate(self._cells), tablefmt='psql'))
+        return "{cells}".format(cells=tabulate(enumerate(ASM.names(self._cells)), tablefmt='psql'))
+
+
+## emulates a swap stored in a memory mapped file, so big swaps don't live in the Python heap
+class MappedSwap(Swap):
+
+    def __init__(self, size, path):
+        self._path = path
+        self._file = open(path, "w+b")
+        ## an empty file can't be mapped, a swap of size 0 maps one page anyway
+        length = max(size, mmap.PAGESIZE)
+        self._file.truncate(length)
+        super().__init__(size, mmap.mmap(self._file.fileno(), length))
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._view.release()
+        close_map(self._cells)
+        self._file.close()
 
 
 ## emulates the Hard Disk Drive (HDD)
+## Each program has an entry in the page index: a view of its instructions and its number of pages
+## (for the frame size of the disk), so pages are served as zero-copy slices
 class HDD():
 
     def __init__(self):
         self._memory = { }
+        self._index = { }
+        self._frame_size = None
 
     @property
     def memory(self):
         return self._memory
 
+    @property
+    def frame_size(self):
+        return self._frame_size
+
+    @frame_size.setter
+    def frame_size(self, value):
+        self._frame_size = value
+        for name, entry in self._index.items():
+            self._index[name] = (entry[0], self.count_pages(len(entry[0])))
+
     def addProgram(self, program):
         name = program.name
-        instructions = program.instructions
+        ## the disk keeps its own copy, later changes to the program don't reach it
+        instructions = ASM.encode(program.instructions)
         self._memory[name] = instructions
+        self.index(name, memoryview(instructions))
 
     def getProgram(self, name):
         return self._memory[name]
 
     def deleteProgram(self, name):
         del self._memory[name]
+        del self._index[name]
+
+    def close(self):
+        pass
 
+    def index(self, name, view):
+        self._index[name] = (view, self.count_pages(len(view)))
+
+    def count_pages(self, length):
+        if self._frame_size is None:
+            return None
+        return -(-length // self._frame_size)
+
+    ## number of pages of the program for the frame size of the disk
+    def pages(self, name):
+        return self._index[name][1]
+
+    ## returns a view of the page (empty past the end of the program)
     def getPage(self, name, page, frame_size):
-        program = self.getProgram(name)
+        view = self._index[name][0]
         direction = page * frame_size
-        program_size = len(program)
-        counter = 0
-        instructions = []
-        while (direction < program_size) & (counter < frame_size):
-            instructions.append(program[direction])
-            direction += 1
-            counter += 1
-        return instructions
+        return view[direction:direction + frame_size]
+
+    ## returns the views of several pages of a program (i.e. for an eager load)
+    def getPages(self, name, pages, frame_size):
+        view = self._index[name][0]
+        return [view[page * frame_size:(page + 1) * frame_size] for page in pages]
 
     def __repr__(self):
         string = ""
         for key, value in self._memory.items():
-            string = string + "\n" + str(key) + " ---> " + str(value)
+            string = string + "\n" + str(key) + " ---> " + str(ASM.names(value))
         return "DISK\n{programs}"\
             .format(programs=string)
 
 
+## emulates a Hard Disk Drive stored in a memory mapped file (a disk image)
+## Every program starts at an OS page boundary of the image and the program directory
+## (name -> offset and length) is kept next to the image, in <image>.dir, so an existing
+## image is ready as soon as it is mapped. Programs and pages are zero-copy views of the image.
+class MappedHDD(HDD):
+
+    def __init__(self, path):
+        super().__init__()
+        self._path = path
+        self._directory_path = path + ".dir"
+        self._directory = { }
+        self._end = 0
+        if os.path.exists(path):
+            ## without its directory the programs of the image can't be found, the image is never overwritten
+            if not os.path.exists(self._directory_path):
+                raise Exception("Invalid disk image {path}: missing program directory {directory}"
+                                .format(path=path, directory=self._directory_path))
+            with open(self._directory_path) as directory_file:
+                metadata = json.load(directory_file)
+            self._directory = {name: tuple(entry) for name, entry in metadata["programs"].items()}
+            self._end = metadata["end"]
+            self._file = open(path, "r+b")
+        else:
+            self._file = open(path, "w+b")
+        self._map = None
+        self._view = None
+        self.__map(max(os.path.getsize(path), self._end, mmap.PAGESIZE))
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def memory(self):
+        return {name: self.getProgram(name) for name in self._directory}
+
+    def addProgram(self, program):
+        instructions = program.instructions
+        offset = self._end
+        end = offset + len(instructions)
+        if end > len(self._map):
+            self.__map(max(end, 2 * len(self._map)))
+        self._view[offset:end] = instructions
+        self._directory[program.name] = (offset, len(instructions))
+        self.index(program.name, self._view[offset:end])
+        ## the next program starts at the next page of the image
+        self._end = -(-end // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.__save_directory()
+
+    def getProgram(self, name):
+        return self._index[name][0]
+
+    def deleteProgram(self, name):
+        ## only the directory entry is deleted, the image space is not reused
+        del self._directory[name]
+        del self._index[name]
+        self.__save_directory()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._map.flush()
+        self._index = { }
+        self._view.release()
+        close_map(self._map)
+        self._file.close()
+
+    ## (re)maps the image with at least size bytes, older views keep the previous mapping alive
+    def __map(self, size):
+        if os.path.getsize(self._path) < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._view = memoryview(self._map)
+        for name, (offset, length) in self._directory.items():
+            self.index(name, self._view[offset:offset + length])
+
+    def __save_directory(self):
+        metadata = {"end": self._end,
+                    "programs": {name: list(entry) for name, entry in self._directory.items()}}
+        with open(self._directory_path, "w") as directory_file:
+            json.dump(metadata, directory_file)
+
+    def __repr__(self):
+        string = ""
+        for key, value in self.memory.items():
+            string = string + "\n" + str(key) + " ---> " + str(ASM.names(value))
+        return "DISK IMAGE {path}\n{programs}"\
+            .format(path=self._path, programs=string)
+
+
 ## emulates the main memory (RAM)
-class Memory():
+class Memory(FrameStorage):
 
     def __init__(self, size):
-        self._cells = [''] * size
+        super().__init__(size)
+
+    def __repr__(self):
+        return tabulate(enumerate(ASM.names(self._cells)), tablefmt='psql')
+
+
+## emulates a Translation Lookaside Buffer (TLB), a cache of page -> frame translations
+## The size entries are split in size / associativity sets (associativity None = fully associative)
+## and page p is cached in the set p % sets. When a set is full, policy "lru" replaces its least
+## recently used entry and "random" any of them. A tagged TLB tags the entries with the ASID (pid)
+## of their address space and keeps them across context switches, otherwise it is flushed.
+class TLB:
+
+    def __init__(self, size, associativity=None, policy="lru", tagged=False, seed=None):
+        if associativity is None:
+            associativity = size
+        if (size % associativity != 0) or (policy not in ("lru", "random")):
+            raise Exception("Invalid TLB: {size} entries, associativity {associativity}, policy {policy}"
+                            .format(size=size, associativity=associativity, policy=policy))
         self._size = size
+        self._associativity = associativity
+        self._policy = policy
+        self._tagged = tagged
+        self._random = random.Random(seed)
+        self._sets = [OrderedDict() for index in range(0, size // associativity)]
+        self._asid = None
+        self._hits = 0
+        self._misses = 0
+        self._flushes = 0
 
     @property
     def size(self):
         return self._size
 
-    def put(self, addr, value):
-        self._cells[addr] = value
+    @property
+    def associativity(self):
+        return self._associativity
 
-    def get(self, addr):
-        return self._cells[addr]
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def tagged(self):
+        return self._tagged
+
+    @property
+    def asid(self):
+        return self._asid
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def flushes(self):
+        return self._flushes
+
+    ## returns the frame of the page in the current address space, None on a miss
+    def lookup(self, page):
+        entries = self._sets[page % len(self._sets)]
+        frame = entries.get((self._asid, page))
+        if frame is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+            if self._policy == "lru":
+                entries.move_to_end((self._asid, page))
+        return frame
+
+    def insert(self, page, frame):
+        entries = self._sets[page % len(self._sets)]
+        if len(entries) >= self._associativity:
+            if self._policy == "lru":
+                entries.popitem(last=False)
+            else:
+                del entries[self._random.choice(list(entries.keys()))]
+        entries[(self._asid, page)] = frame
+
+    ## called on every context switch
+    def switch(self, asid):
+        if not self._tagged:
+            self.flush()
+        self._asid = asid
+
+    def flush(self):
+        for entries in self._sets:
+            entries.clear()
+        self._flushes += 1
+
+    ## drops the translations to a frame (it was given to another page)
+    def invalidate_frame(self, frame):
+        for entries in self._sets:
+            for key in [key for key, value in entries.items() if value == frame]:
+                del entries[key]
+
+    ## drops the translations of an address space (its process has finished)
+    def invalidate_asid(self, asid):
+        for entries in self._sets:
+            for key in [key for key in entries.keys() if key[0] == asid]:
+                del entries[key]
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {"hits": self._hits, "misses": self._misses, "flushes": self._flushes,
+                "hit_rate": self._hits / lookups if lookups > 0 else None}
 
     def __repr__(self):
-        return tabulate(enumerate(self._cells), tablefmt='psql')
+        return "TLB ({size} entries, {associativity} ways, {policy}, tagged: {tagged}) hits: {hits} " \
+               "misses: {misses} flushes: {flushes}\n{sets}" \
+            .format(size=self._size, associativity=self._associativity, policy=self._policy,
+                    tagged=self._tagged, hits=self._hits, misses=self._misses, flushes=self._flushes,
+                    sets=self._sets)
 
 
 ## emulates the Memory Management Unit (MMU)
+## translate() looks the page up in the TLB (if there is one) and walks the page table on a miss
+## on_access is an optional function called with the frame of every translated access
+## (i.e. so the page replacement algorithm can follow the references)
+## reference_trace is an optional recorder of the (asid, page) of every access
 class MMU:
 
-    def __init__(self, memory):
+    def __init__(self, memory, tlb=None):
         self._memory = memory
         self._page_table = None
+        self._asid = None
         self._frame_size = None
+        self._tlb = tlb
+        self._on_access = None
+        self._reference_trace = None
 
     @property
     def page_table(self):
@@ -261,6 +728,59 @@ class MMU:
     def page_table(self, table):
         self._page_table = table
 
+    @property
+    def tlb(self):
+        return self._tlb
+
+    @property
+    def on_access(self):
+        return self._on_access
+
+    @on_access.setter
+    def on_access(self, function):
+        self._on_access = function
+
+    @property
+    def reference_trace(self):
+        return self._reference_trace
+
+    @reference_trace.setter
+    def reference_trace(self, trace):
+        self._reference_trace = trace
+
+    @property
+    def asid(self):
+        return self._asid
+
+    ## loads the page table of another address space
+    def switch_context(self, table, asid):
+        self._page_table = table
+        self._asid = asid
+        if self._tlb is not None:
+            self._tlb.switch(asid)
+
+    ## the frame was given to another page: its cached translations are no longer valid
+    def invalidate_frame(self, frame):
+        if self._tlb is not None:
+            self._tlb.invalidate_frame(frame)
+
+    def invalidate_asid(self, asid):
+        if self._tlb is not None:
+            self._tlb.invalidate_asid(asid)
+
+    def translate(self, page_number):
+        tlb = self._tlb
+        if tlb is None:
+            frame_number = self.walk(page_number)
+        else:
+            frame_number = tlb.lookup(page_number)
+            if frame_number is None:
+                frame_number = self.walk(page_number)
+                tlb.insert(page_number, frame_number)
+        if self._on_access is not None:
+            self._on_access(frame_number)
+        return frame_number
+
     @property
     def frame_size(self):
         return self._frame_size
@@ -269,48 +789,61 @@ class MMU:
     def frame_size(self, value):
         self._frame_size = value
 
+    ## only called when logging is enabled, the page table is formatted lazily
+    def log_translation(self, page_number, offset, logical_address, physical_address):
+        log.logger.info("%s", self.page_table)
+        log.logger.info("Page number: %s", page_number)
+        log.logger.info("Offset: %s", offset)
+        log.logger.info("Logical address: %s", logical_address)
+        log.logger.info("Physical address: %s", physical_address)
+
 
 class MMUPagination(MMU):
 
-    def __init__(self, memory):
-        super().__init__(memory)
+    def __init__(self, memory, tlb=None):
+        super().__init__(memory, tlb)
 
     def fetch(self, logical_address):
         pair_div_mod = divmod(logical_address, self.frame_size)
         page_number = pair_div_mod[0]
         offset = pair_div_mod[1]
-        log.logger.info(self.page_table)
-        frame_number = self.page_table.page_list[page_number][0]
+        frame_number = self.translate(page_number)
         physical_address = self.frame_size * frame_number + offset
-        log.logger.info("Page number:" + str(page_number))
-        log.logger.info("Offset: " + str(offset))
-        log.logger.info("Logical address: " + str(logical_address))
-        log.logger.info("Physical address: " + str(physical_address))
+        if log.enabled:
+            self.log_translation(page_number, offset, logical_address, physical_address)
         return self._memory.get(physical_address)
 
+    def walk(self, page_number):
+        return self.page_table.find_frame(page_number)
+
     def __repr__(self):
         return "MMUPagination ---> {table}".format(table=self.page_table)
 
 
+## sets the reference bit of the page on every access (for the page replacement algorithm)
 class MMUPaginationOnDemand(MMU):
 
-    def __init__(self, memory):
-        super().__init__(memory)
+    def __init__(self, memory, tlb=None):
+        super().__init__(memory, tlb)
 
     def fetch(self, logical_address):
         pair_div_mod = divmod(logical_address, self.frame_size)
         page_number = pair_div_mod[0]
         offset = pair_div_mod[1]
+        frame_number = self.translate(page_number)
+        self._page_table.reference(page_number)
+        if self._reference_trace is not None:
+            self._reference_trace.record(self._asid, page_number)
+        physical_address = self.frame_size * frame_number + offset
+        if log.enabled:
+            self.log_translation(page_number, offset, logical_address, physical_address)
+        return self._memory.get(physical_address)
+
+    def walk(self, page_number):
         if not self.page_table.page_is_loaded(page_number):
             page_fault_IRQ = IRQ(PAGE_FAULT_INTERRUPTION_TYPE, page_number)
             HARDWARE.interruptVector.handle(page_fault_IRQ)
-        frame_number = self.page_table.find_frame(page_number)
-        physical_address = self.frame_size * frame_number + offset
-        log.logger.info("Page number:" + str(page_number))
-        log.logger.info("Offset: " + str(offset))
-        log.logger.info("Logical address: " + str(logical_address))
-        log.logger.info("Physical address: " + str(physical_address))
-        return self._memory.get(physical_address)
+        return self.page_table.find_frame(page_number)
 
     def __repr__(self):
         return "MMUPaginationOnDemand ---> {table}".format(table=self.page_table)
@@ -324,6 +857,9 @@ class Cpu():
         self._interruptVector = interruptVector
         self._pc = -1
         self._ir = None
+        self._executed = 0
+        ## execution of each instruction, indexed by opcode
+        self._operations = (self._execute_cpu, self._execute_cpu, self._execute_io, self._execute_exit)
 
 
     def tick(self, tickNbr):
@@ -331,27 +867,42 @@ class Cpu():
             self._fetch()
             self._decode()
             self._execute()
-        else:
+        elif log.enabled:
             log.logger.info("cpu - NOOP")
 
+    ## a running cpu executes an instruction every tick, an idle one waits for an irq
+    def next_event(self, tickNbr):
+        if (self._pc > -1):
+            return 0
+        return None
+
+    def skip(self, ticks):
+        ## NOOP
+        pass
 
     def _fetch(self):
         self._ir = self._mmu.fetch(self._pc)
         self._pc += 1
+        self._executed += 1
 
     def _decode(self):
         ## decode no hace nada en este caso
         pass
 
     def _execute(self):
-        if ASM.isEXIT(self._ir):
-            killIRQ = IRQ(KILL_INTERRUPTION_TYPE)
-            self._interruptVector.handle(killIRQ)
-        elif ASM.isIO(self._ir):
-            ioInIRQ = IRQ(IO_IN_INTERRUPTION_TYPE, self._ir)
-            self._interruptVector.handle(ioInIRQ)
-        else:
-            log.logger.info("cpu - Exec: {instr}, PC={pc}".format(instr=self._ir, pc=self._pc))
+        self._operations[self._ir]()
+
+    def _execute_exit(self):
+        killIRQ = IRQ(KILL_INTERRUPTION_TYPE)
+        self._interruptVector.handle(killIRQ)
+
+    def _execute_io(self):
+        ioInIRQ = IRQ(IO_IN_INTERRUPTION_TYPE, self._ir)
+        self._interruptVector.handle(ioInIRQ)
+
+    def _execute_cpu(self):
+        if log.enabled:
+            log.logger.info("cpu - Exec: %s, PC=%s", ASM.name(self._ir), self._pc)
 
     @property
     def pc(self):
@@ -361,6 +912,11 @@ class Cpu():
     def pc(self, addr):
         self._pc = addr
 
+    ## number of instructions fetched since the hardware was set up
+    @property
+    def executed(self):
+        return self._executed
+
 
     def __repr__(self):
         return "CPU(PC={pc})".format(pc=self._pc)
@@ -390,7 +946,7 @@ class AbstractIODevice():
     def execute(self, operation):
         if (self._busy):
             raise Exception("Device {id} is busy, can't  execute operation: {op}"
-                            .format(id = self.deviceId, op = operation))
+                            .format(id = self.deviceId, op = ASM.name(operation)))
         else:
             self._busy = True
             self._ticksCount = 0
@@ -404,9 +960,18 @@ class AbstractIODevice():
                 self._busy = False
                 ioOutIRQ = IRQ(IO_OUT_INTERRUPTION_TYPE, self._deviceId)
                 HARDWARE.interruptVector.handle(ioOutIRQ)
-            else:
-                log.logger.info("device {deviceId} - Busy: {ticksCount} of {deviceTime}"
-                                .format(deviceId = self.deviceId, ticksCount = self._ticksCount, deviceTime = self._deviceTime))
+            elif log.enabled:
+                log.logger.info("device %s - Busy: %s of %s", self.deviceId, self._ticksCount, self._deviceTime)
+
+    ## ticks until the running operation finishes, None if the device is idle
+    def next_event(self, tickNbr):
+        if (self._busy):
+            return max(self._deviceTime - self._ticksCount, 0)
+        return None
+
+    def skip(self, ticks):
+        if (self._busy):
+            self._ticksCount += ticks
 
 
 class PrinterIODevice(AbstractIODevice):
@@ -418,16 +983,38 @@ class PrinterIODevice(AbstractIODevice):
 class Hardware():
 
     ## Setup our hardware
-    def setup(self, memorySize, swapSize):
+    ## ticks_per_second = None sets the clock in virtual time (no real time pacing)
+    ## event_driven = True replaces the tick loop with the discrete event clock
+    ## on_demand = True sets the MMU for pagination on demand (page faults)
+    ## disk_image and swap_file are optional paths of memory mapped files backing the HDD and the swap
+    ## tlb is an optional TLB for the MMU
+    def setup(self, memorySize, swapSize, ticks_per_second=1, event_driven=False, on_demand=False,
+              disk_image=None, swap_file=None, tlb=None):
+        ## the files of a previous setup are released before they are replaced
+        if hasattr(self, "_swap"):
+            self._swap.close()
+            self._disk.close()
         ## add the components to the "motherboard"
-        self._swap = Swap(swapSize)
-        self._disk = HDD()
+        if swap_file is None:
+            self._swap = Swap(swapSize)
+        else:
+            self._swap = MappedSwap(swapSize, swap_file)
+        if disk_image is None:
+            self._disk = HDD()
+        else:
+            self._disk = MappedHDD(disk_image)
         self._memory = Memory(memorySize)
         self._interruptVector = InterruptVector()
-        self._clock = Clock()
+        if event_driven:
+            self._clock = EventDrivenClock(self._interruptVector, ticks_per_second)
+        else:
+            self._clock = Clock(ticks_per_second)
         self._timer = Timer(self._interruptVector)
         self._ioDevice = PrinterIODevice()
-        self._mmu = MMUPagination(self._memory)  # TODO: change for MMUPaginationOnDemand
+        if on_demand:
+            self._mmu = MMUPaginationOnDemand(self._memory, tlb)
+        else:
+            self._mmu = MMUPagination(self._memory, tlb)
         self._cpu = Cpu(self._mmu, self._interruptVector)
         self._clock.addSubscriber(self._timer)
         self._clock.addSubscriber(self._ioDevice)
@@ -2,11 +2,30 @@ import logging
 
 logger = logging.getLogger()
 
+# Cheap flag checked by the hot paths (tick, fetch, irqs) before building a log message.
+# It follows the logger level and can be forced off with set_quiet(True).
+quiet = False
+enabled = logger.isEnabledFor(logging.INFO)
 
-def setup_logger():
+
+def setup_logger(stream=None):
     # Configure Logger
-    handler = logging.StreamHandler()
+    handler = logging.StreamHandler(stream)
     formatter = logging.Formatter('%(message)s')
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     logger.setLevel(logging.DEBUG)
+    refresh()
+
+
+def set_quiet(value):
+    # Quiet mode removes the logging of the emulator, whatever the logger level is
+    global quiet
+    quiet = value
+    refresh()
+
+
+def refresh():
+    # Must be called after changing the logger level by hand
+    global enabled
+    enabled = (not quiet) and logger.isEnabledFor(logging.INFO)
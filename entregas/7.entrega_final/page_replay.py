@@ -0,0 +1,168 @@
+from array import array
+from heapq import heappush, heappop
+
+from hardware import HARDWARE
+from so import FrameAllocator, PageTable
+
+
+# Reference string of a run: the (pid, page) of every memory access with its tick
+# Consecutive accesses to the same page are recorded once, with the tick of the first of them. That doesn't
+# change the faults of the algorithms that only follow the order of the references, but the algorithms with a
+# window of ticks (ws, wsclock) see an older last use than the live run did, so their replay is approximate
+class ReferenceTrace:
+
+    def __init__(self):
+        self._pids = array('l')
+        self._pages = array('l')
+        self._ticks = array('l')
+        self._last = None
+
+    # starts recording the accesses of the MMU
+    def attach(self):
+        HARDWARE.mmu.reference_trace = self
+
+    def detach(self):
+        HARDWARE.mmu.reference_trace = None
+
+    def record(self, pid, page):
+        reference = (pid, page)
+        if reference != self._last:
+            self._last = reference
+            self._pids.append(pid)
+            self._pages.append(page)
+            self._ticks.append(HARDWARE.clock.tickNbr)
+
+    @property
+    def pids(self):
+        return self._pids
+
+    @property
+    def pages(self):
+        return self._pages
+
+    @property
+    def ticks(self):
+        return self._ticks
+
+    def references(self):
+        return zip(self._pids, self._pages)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __repr__(self):
+        return "REFERENCE TRACE\nReferences: {n}".format(n=len(self))
+
+
+# Index of the next use of the same (pid, page) for every reference of the trace (len(trace) if never used again)
+def next_uses(trace):
+    never = len(trace)
+    result = array('l', [never]) * never
+    last_seen = {}
+    references = list(trace.references())
+    for index in range(never - 1, -1, -1):
+        reference = references[index]
+        result[index] = last_seen.get(reference, never)
+        last_seen[reference] = index
+    return result
+
+
+# Belady's optimal replacement: the victim is the resident page used again the farthest in the future.
+# The resident pages are kept in a heap by next use (stale entries are skipped), so it is O(n log n)
+def optimal_faults(trace, frames_number):
+    next_use = next_uses(trace)
+    resident = {}
+    heap = []
+    faults = 0
+    for index, reference in enumerate(trace.references()):
+        if reference not in resident:
+            faults += 1
+            if len(resident) == frames_number:
+                while True:
+                    use, victim = heappop(heap)
+                    if resident.get(victim) == -use:
+                        del resident[victim]
+                        break
+        resident[reference] = next_use[index]
+        heappush(heap, (-next_use[index], reference))
+    return faults
+
+
+# Stands for the clock of the emulator while replaying a trace (the working set algorithms read the time from it)
+class ReplayClock:
+
+    def __init__(self):
+        self._tickNbr = 0
+
+    @property
+    def tickNbr(self):
+        return self._tickNbr
+
+    @tickNbr.setter
+    def tickNbr(self, value):
+        self._tickNbr = value
+
+
+# Stands for the memory manager of the page replacement algorithms while replaying a trace:
+# the pages are loaded on fault and a victim is chosen when there are no free frames, as the emulator does
+class ReplayMemoryManager:
+
+    def __init__(self, frames_number):
+        self._frames = FrameAllocator(frames_number)
+        self._clock = ReplayClock()
+        self._owners = {}
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @property
+    def clock(self):
+        return self._clock
+
+    # the replayed pages are never shared
+    def frame_entries(self, frame):
+        return [self._owners[frame]]
+
+    # algorithm_factory builds the algorithm from this memory manager, returns the number of faults
+    def replay(self, trace, algorithm_factory):
+        algorithm = algorithm_factory(self)
+        tracks_accesses = algorithm.tracks_accesses()
+        pages_number = {}
+        for pid, page in trace.references():
+            pages_number[pid] = max(pages_number.get(pid, 0), page + 1)
+        tables = {pid: PageTable(number) for pid, number in pages_number.items()}
+        owners = self._owners
+        faults = 0
+        for pid, page, tick in zip(trace.pids, trace.pages, trace.ticks):
+            self._clock.tickNbr = tick
+            table = tables[pid]
+            if not table.page_is_loaded(page):
+                faults += 1
+                algorithm.fault(pid)
+                frame = self._frames.allocate()
+                if frame is None:
+                    frame = algorithm.get_victim()
+                    victim_table, victim_page = owners[frame]
+                    victim_table.set_swap(victim_page, True)
+                    algorithm.remove_frame(frame)
+                table.update(page, frame)
+                table.set_swap(page, False)
+                table.set_timestamp(page, tick)
+                owners[frame] = (table, page)
+                algorithm.add_frame(frame, table, page, pid)
+            table.reference(page)
+            if tracks_accesses:
+                algorithm.touch(table.find_frame(page))
+        return faults
+
+
+# Faults of every algorithm (name -> factory) and of the optimal replacement ("opt") for the same trace
+# The counts can differ from the live run: the replay never releases the frames of a terminated process, and
+# for the algorithms with a window of ticks (ws, wsclock) the trace keeps only the tick of the first access of
+# every run of references to the same page
+def replay_report(trace, frames_number, algorithm_factories):
+    report = {"references": len(trace), "frames": frames_number, "opt": optimal_faults(trace, frames_number)}
+    for name, factory in algorithm_factories.items():
+        report[name] = ReplayMemoryManager(frames_number).replay(trace, factory)
+    return report
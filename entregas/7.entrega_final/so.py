@@ -1,5 +1,9 @@
 #!/usr/bin/env python
+import struct
 import sys
+from array import array
+from collections import deque, OrderedDict
+from heapq import heappush, heappop
 
 from hardware import *
 import log
@@ -25,15 +29,16 @@ class Program:
         instruction1 = instruction
         self._instructions.append(instruction1)
 
+    # the instructions are stored encoded, one opcode per byte
     @staticmethod
     def expand(instructions):
-        expanded = []
+        expanded = ASM.encode([])
         for i in instructions:
             if isinstance(i, list):
                 # is a list of instructions
                 expanded.extend(i)
             else:
-                # a single instr (a String)
+                # a single instr (an opcode)
                 expanded.append(i)
 
         # now test if last instruction is EXIT
@@ -46,7 +51,7 @@ class Program:
 
     def __repr__(self):
         return "Program({name}, {instructions})" \
-            .format(name=self._name, instructions=self._instructions)
+            .format(name=self._name, instructions=ASM.names(self._instructions))
 
 
 # emulates an Input/Output device controller (driver)
@@ -97,8 +102,9 @@ class IoDeviceController:
         return (len(self._waiting_queue) == 0) & (self._current_pcb is None)
 
     def __repr__(self):
+        waiting_queue = [{'pcb': pair['pcb'], 'instruction': ASM.name(pair['instruction'])} for pair in self._waiting_queue]
         return "IoDeviceController for {deviceID} running: {currentPCB} waiting: {waiting_queue}" \
-            .format(deviceID=self._device.deviceId, currentPCB=self._current_pcb, waiting_queue=self._waiting_queue)
+            .format(deviceID=self._device.deviceId, currentPCB=self._current_pcb, waiting_queue=waiting_queue)
 
 
 # emulates the  Interruptions Handlers
@@ -131,7 +137,7 @@ class AbstractInterruptionHandler:
 
     def check_priorities(self, pcb):
         current = self.kernel.get_current()
-        if pcb.priority < current.priority:
+        if self.kernel.scheduler.preempts(pcb, current):
             log.logger.info(" Switching processes based on priority ")
             self.kernel.dispatcher.save(current)
             self.kernel.add(current)
@@ -163,9 +169,11 @@ class IoInInterruptionHandler(AbstractInterruptionHandler):
         pcb = self.kernel.scheduler.current
         self.kernel.change_state(pcb, "Waiting")
         self.kernel.dispatcher.save(pcb)
+        self.kernel.scheduler.blocked(pcb)
         self.kernel.io_device_controller.run_operation(pcb, operation)
         self.kernel.terminate()
-        log.logger.info(self.kernel.io_device_controller)
+        if log.enabled:
+            log.logger.info("%s", self.kernel.io_device_controller)
         self.context_switch()
 
 
@@ -173,7 +181,8 @@ class IoOutInterruptionHandler(AbstractInterruptionHandler):
 
     def execute(self, irq):
         pcb = self.kernel.io_device_controller.get_finished_pcb()
-        log.logger.info(self.kernel.io_device_controller)
+        if log.enabled:
+            log.logger.info("%s", self.kernel.io_device_controller)
         self.get_ready(pcb)
 
 
@@ -192,6 +201,7 @@ class TimeOutInterruptionHandler(AbstractInterruptionHandler):
         if self.kernel.has_running():
             old_pcb = self.kernel.scheduler.current
             self.kernel.dispatcher.save(old_pcb)
+            self.kernel.scheduler.quantum_expired(old_pcb)
             self.kernel.scheduler.add(old_pcb)
             self.kernel.dispatcher.context_switch()
 
@@ -201,22 +211,32 @@ class PageFaultInterruptionHandler(AbstractInterruptionHandler):
     def execute(self, irq):
         page_number = irq.parameters
         pcb = self.kernel.get_current()
-        self.kernel.memory_manager.switch_table(pcb.pid, self.kernel.dispatcher.get_page_table())
-        frame = self.kernel.memory_manager.next_frame()
-        self.kernel.memory_manager.add_possible_victim(frame, page_number, pcb.pid)
-        self.kernel.loader.load_page(pcb, page_number, frame)
-        self.kernel.memory_manager.update_page_table(pcb.pid, page_number, frame)
-        self.kernel.dispatcher.set_page_table(self.kernel.memory_manager.get_table(pcb.pid))
+        self.kernel.memory_manager.page_fault(pcb.pid)
+        if not self.kernel.memory_manager.map_shared_page(pcb.pid, page_number):
+            frame = self.kernel.memory_manager.next_frame()
+            self.kernel.memory_manager.add_possible_victim(frame, page_number, pcb.pid)
+            self.kernel.loader.load_page(pcb, page_number, frame)
+            self.kernel.memory_manager.update_page_table(pcb.pid, page_number, frame)
+        self.kernel.memory_manager.prefetch(pcb, page_number)
 
 
 # emulates the core of an Operative System
 class Kernel:
 
-    def __init__(self, frame_size, memory_factor):
-
-        # TODO: set dependency injection to decide scheduling algorithm and pagination mode
-
-        HARDWARE.setup(frame_size * memory_factor, frame_size * memory_factor)
+    # ticks_per_second = None runs the clock in virtual time (useful for regression runs)
+    # event_driven = True uses the discrete event clock, which skips the idle ticks
+    # on_demand = True loads the pages on page fault instead of loading whole programs
+    # swap_factor is the number of frames of the swap (by default as many as the memory)
+    # disk_image and swap_file back the HDD and the swap with memory mapped files
+    # tlb is an optional TLB for the MMU
+    # page_table_levels = 2 or 3 uses multi level page tables (allocated as the pages are loaded)
+    def __init__(self, frame_size, memory_factor, ticks_per_second=1, event_driven=False, on_demand=False,
+                 swap_factor=None, disk_image=None, swap_file=None, tlb=None, page_table_levels=1):
+
+        if swap_factor is None:
+            swap_factor = memory_factor
+        HARDWARE.setup(frame_size * memory_factor, frame_size * swap_factor, ticks_per_second, event_driven,
+                       on_demand, disk_image, swap_file, tlb)
 
         # setup interruption handlers
         kill_handler = KillInterruptionHandler(self)
@@ -239,7 +259,12 @@ class Kernel:
 
         # controls the Hardware's I/O Device
         self._io_device_controller = IoDeviceController(self, HARDWARE.ioDevice)
-        self._memory_manager = MemoryManagerPagination(self, frame_size, HARDWARE.memory.size) #TODO: change for MemoryManagerPaginationOnDemand
+        if on_demand:
+            self._memory_manager = MemoryManagerPaginationOnDemand(self, frame_size, HARDWARE.memory.size,
+                                                                   page_table_levels)
+        else:
+            self._memory_manager = MemoryManagerPagination(self, frame_size, HARDWARE.memory.size,
+                                                           page_table_levels)
         self._swap_manager = SwapManager(self, frame_size)
         self._loader = Loader(self)
         self._dispatcher = Dispatcher(self)
@@ -276,6 +301,11 @@ class Kernel:
     def scheduler(self):
         return self._scheduler
 
+    # the scheduling algorithm can be replaced before executing any program
+    @scheduler.setter
+    def scheduler(self, scheduling_algorithm):
+        self._scheduler = scheduling_algorithm
+
     def has_next(self):
         return self.scheduler.has_next()
 
@@ -301,7 +331,7 @@ class Kernel:
         program = Program(program_name, instructions)
         new_irq = IRQ(NEW_INTERRUPTION_TYPE, program)
         HARDWARE.interruptVector.handle(new_irq)
-        log.logger.info("\nExecuting program: {name}".format(name=program_name))
+        log.logger.info("\nExecuting program: %s", program_name)
         # self.dispatcher.start() # TODO: make sure this is not necessary!!!
 
     def has_finished(self):
@@ -312,8 +342,13 @@ class Kernel:
         self.table.current = None
         self.dispatcher.idle()
 
+    # the ticks of every process in the ready queue are accounted for the scheduling measures
     def change_state(self, pcb, new_state):
+        tick = HARDWARE.clock.tickNbr
+        if pcb.state == "Ready":
+            pcb.add_waiting_ticks(tick - pcb.state_tick)
         pcb.state = new_state
+        pcb.set_state_tick(tick)
         if new_state == "Running":
             self.table.current = pcb
 
@@ -321,11 +356,212 @@ class Kernel:
         return "Kernel "
 
 
+# Ready queues of the scheduling algorithms: add and next are O(1) (O(log n) in the heap), has_next is O(1)
+class FifoReadyQueue:
+
+    def __init__(self):
+        self._pcbs = deque()
+
+    def add(self, pcb):
+        self._pcbs.append(pcb)
+
+    def next(self):
+        return self._pcbs.popleft()
+
+    def has_next(self):
+        return len(self._pcbs) > 0
+
+    def __len__(self):
+        return len(self._pcbs)
+
+    def __iter__(self):
+        return iter(self._pcbs)
+
+    def __repr__(self):
+        return "{pcbs}".format(pcbs=list(self._pcbs))
+
+
+# A FIFO queue for every level, next takes from the first level with processes (level 0 goes first)
+class LevelReadyQueue:
+
+    def __init__(self, levels):
+        self._levels = [deque() for level in range(0, levels)]
+        self._count = 0
+
+    @property
+    def levels(self):
+        return len(self._levels)
+
+    def level(self, level):
+        return self._levels[level]
+
+    def add(self, pcb, level):
+        self._levels[level].append(pcb)
+        self._count += 1
+
+    def next(self):
+        for pcbs in self._levels:
+            if pcbs:
+                self._count -= 1
+                return pcbs.popleft()
+        raise IndexError("next from an empty ready queue")
+
+    # every process goes to the first level, after the ones already there (in level order)
+    def merge_levels(self):
+        first = self._levels[0]
+        for pcbs in self._levels[1:]:
+            first.extend(pcbs)
+            pcbs.clear()
+
+    # moves the first process of the level to the end of the level above
+    def promote_first(self, level):
+        if self._levels[level]:
+            self._levels[level - 1].append(self._levels[level].popleft())
+
+    def has_next(self):
+        return self._count > 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for pcbs in self._levels:
+            yield from pcbs
+
+    def __repr__(self):
+        return "{levels}".format(levels=[list(pcbs) for pcbs in self._levels])
+
+
+# Fenwick (binary indexed) tree of weights: updating a weight and finding where a value falls in the prefix sums
+# are O(log n)
+class FenwickTree:
+
+    def __init__(self, size):
+        self._tree = [0] * (size + 1)
+        self._total = 0
+
+    @property
+    def size(self):
+        return len(self._tree) - 1
+
+    @property
+    def total(self):
+        return self._total
+
+    def add(self, index, delta):
+        self._total += delta
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    # the first index whose prefix sum is greater than value (0 <= value < total)
+    def find(self, value):
+        position = 0
+        step = 1 << (self.size.bit_length() - 1)
+        while step > 0:
+            next_position = position + step
+            if next_position < len(self._tree) and self._tree[next_position] <= value:
+                position = next_position
+                value -= self._tree[next_position]
+            step >>= 1
+        return position
+
+
+# Processes holding tickets: next draws a ticket, every process wins with probability tickets / total tickets
+# The processes take the slots of a Fenwick tree of tickets (doubled when full), so a draw is O(log n)
+class LotteryReadyQueue:
+
+    def __init__(self, seed=0, capacity=16):
+        self._tree = FenwickTree(capacity)
+        self._pcbs = [None] * capacity
+        self._tickets = [0] * capacity
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        self._slots = {}
+        self._random = random.Random(seed)
+
+    def add(self, pcb, tickets):
+        if not self._free_slots:
+            self.grow()
+        slot = self._free_slots.pop()
+        self._pcbs[slot] = pcb
+        self._tickets[slot] = tickets
+        self._slots[pcb.pid] = slot
+        self._tree.add(slot, tickets)
+
+    def next(self):
+        slot = self._tree.find(self._random.randrange(self._tree.total))
+        pcb = self._pcbs[slot]
+        self._tree.add(slot, -self._tickets[slot])
+        self._pcbs[slot] = None
+        self._tickets[slot] = 0
+        del self._slots[pcb.pid]
+        self._free_slots.append(slot)
+        return pcb
+
+    # changes the tickets of a process in the queue (nothing if it is not there)
+    def update(self, pcb, tickets):
+        slot = self._slots.get(pcb.pid)
+        if slot is not None:
+            self._tree.add(slot, tickets - self._tickets[slot])
+            self._tickets[slot] = tickets
+
+    def grow(self):
+        capacity = len(self._pcbs)
+        self._tree = FenwickTree(capacity * 2)
+        for slot in range(0, capacity):
+            self._tree.add(slot, self._tickets[slot])
+        self._pcbs.extend([None] * capacity)
+        self._tickets.extend([0] * capacity)
+        self._free_slots.extend(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def has_next(self):
+        return len(self._slots) > 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __iter__(self):
+        return (pcb for pcb in self._pcbs if pcb is not None)
+
+    def __repr__(self):
+        return "{pcbs}".format(pcbs=list(self))
+
+
+# Binary heap of processes: next takes the one with the lowest key, the ties in arrival order
+class HeapReadyQueue:
+
+    def __init__(self):
+        self._heap = []
+        self._arrivals = 0
+
+    def add(self, pcb, key):
+        heappush(self._heap, (key, self._arrivals, pcb))
+        self._arrivals += 1
+
+    def next(self):
+        return heappop(self._heap)[2]
+
+    def has_next(self):
+        return len(self._heap) > 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    # in no particular order
+    def __iter__(self):
+        return (pcb for key, arrival, pcb in self._heap)
+
+    def __repr__(self):
+        return "{pcbs}".format(pcbs=[pcb for key, arrival, pcb in sorted(self._heap, key=lambda entry: entry[:2])])
+
+
 class SchedulingAlgorithm:
 
     def __init__(self, kernel):
         self._current = None
         self._kernel = kernel
+        self._queue = self.new_ready_queue()
 
     @property
     def kernel(self):
@@ -335,69 +571,80 @@ class SchedulingAlgorithm:
     def current(self):
         return self._current
 
+    @property
+    def queue(self):
+        return self._queue
+
+    def new_ready_queue(self):
+        return FifoReadyQueue()
+
     def has_current(self):
         return not (self.current is None)
 
     def set_current(self, pcb):
         self._current = pcb
 
+    def has_next(self):
+        return self._queue.has_next()
+
     def check_preemptive(self):
         return False
 
+    # a preemptive algorithm tells if the process that got ready takes the CPU from the current one
+    def preempts(self, pcb, current):
+        return False
 
-class FirstComeFirstServed(SchedulingAlgorithm):
-    # Processes are assigned the CPU in the order they request it
-    # Non-preemptive (lets a process run until it blocks)
-
-    def __init__(self, kernel):
-        super().__init__(kernel)
-        self._queue = []
+    # the process left the CPU to wait for IO, its CPU burst is over
+    def burst_finished(self, pcb):
+        pcb.end_burst()
 
-    @property
-    def queue(self):
-        return self._queue
+    # the process used up its quantum
+    def quantum_expired(self, pcb):
+        pass
 
-    def add(self, pcb):
-        self._queue.append(pcb)
-        self.kernel.change_state(pcb, "Ready")
+    # the process leaves the CPU after running ticks
+    def charge(self, pcb, ticks):
+        pass
 
-    def next(self):
-        return self._queue.pop(0)
+    # the process is about to wait for the IO device
+    def blocked(self, pcb):
+        pass
 
-    def has_next(self):
-        return len(self._queue) > 0
+    # quantum of the timer while the process runs, None keeps the quantum of the timer
+    def quantum_for(self, pcb):
+        return None
 
     def print_ready(self):
         for pcb in self._queue:
             print(pcb)
 
 
+class FirstComeFirstServed(SchedulingAlgorithm):
+    # Processes are assigned the CPU in the order they request it
+    # Non-preemptive (lets a process run until it blocks)
+
+    def add(self, pcb):
+        self._queue.add(pcb)
+        self.kernel.change_state(pcb, "Ready")
+
+    def next(self):
+        return self._queue.next()
+
+
 class RoundRobin(SchedulingAlgorithm):
     # Each process is assigned a time interval (quantum), during which it is allowed to run
     # Preemptive (lets a process run for a maximum of some fixed time)
 
     def __init__(self, kernel, value):
         super().__init__(kernel)
-        self._queue = []
         HARDWARE.timer.set_on(value)
 
-    @property
-    def queue(self):
-        return self._queue
-
     def add(self, pcb):
-        self._queue.append(pcb)
+        self._queue.add(pcb)
         self.kernel.change_state(pcb, "Ready")
 
     def next(self):
-        return self._queue.pop(0)
-
-    def has_next(self):
-        return len(self._queue) > 0
-
-    def print_ready(self):
-        for pcb in self._queue:
-            print(pcb)
+        return self._queue.next()
 
 
 class Priority(SchedulingAlgorithm):
@@ -409,48 +656,332 @@ class Priority(SchedulingAlgorithm):
     def __init__(self, kernel, boolean):
         super().__init__(kernel)
         self._is_preemptive = boolean
-        self._queue = [[], [], [], [], []]
-        self._has_pcbs = [False, False, False, False, False]
 
-    @property
-    def queue(self):
-        return self._queue
+    def new_ready_queue(self):
+        return LevelReadyQueue(5)
 
     def add(self, pcb):
-        priority = pcb.priority
-        self._queue[priority].append(pcb)
-        self._has_pcbs[priority] = True
+        self._queue.add(pcb, pcb.priority)
 
     def next(self):
-        level = self._has_pcbs.index(True)
-        next_pcb = self._queue[level].pop(0)
-        self.check_level(level)
+        next_pcb = self._queue.next()
         self.aging()
         return next_pcb
 
+    # the first process of every level goes up one level
     def aging(self):
-        for i in range(1, 5):
-            if self._has_pcbs[i]:
-                going_up = self._queue[i].pop(0)
-                self._queue[i - 1].append(going_up)
-                self.check_level(i)
-                self.check_level(i-1)
-
-    def check_level(self, level):
-        if len(self._queue[level]) == 0:
-            self._has_pcbs[level] = False
-        else:
-            self._has_pcbs[level] = True
-
-    def has_next(self):
-        return any(b == True for b in self._has_pcbs)
+        for level in range(1, self._queue.levels):
+            self._queue.promote_first(level)
 
     def check_preemptive(self):
         return self._is_preemptive
 
+    def preempts(self, pcb, current):
+        return pcb.priority < current.priority
+
+    def print_ready(self):
+        for level in range(0, self._queue.levels):
+            print(list(self._queue.level(level)))
+
+
+class MultilevelFeedbackQueue(SchedulingAlgorithm):
+    # A FIFO queue for every level, the processes start at the top level (0) and the first level with processes
+    # goes first. Every level has its own quantum (longer for the lower levels)
+    # A process that uses up its quantum goes down a level, one that blocks for IO goes up a level
+    # Every boost_period ticks all the processes go back to the top level, so none starves
+    # Preemptive (a process that gets ready takes the CPU from one of a lower level)
+
+    def __init__(self, kernel, quanta=(2, 4, 8), boost_period=100):
+        self._quanta = list(quanta)
+        super().__init__(kernel)
+        self._boost_period = boost_period
+        self._last_boost = HARDWARE.clock.tickNbr
+        self._levels = {}
+        HARDWARE.timer.set_on(self._quanta[0])
+
+    @property
+    def quanta(self):
+        return self._quanta
+
+    @property
+    def boost_period(self):
+        return self._boost_period
+
+    def new_ready_queue(self):
+        return LevelReadyQueue(len(self._quanta))
+
+    def level(self, pcb):
+        return self._levels.get(pcb.pid, 0)
+
+    def add(self, pcb):
+        self._queue.add(pcb, self.level(pcb))
+        self.kernel.change_state(pcb, "Ready")
+
+    def next(self):
+        if HARDWARE.clock.tickNbr - self._last_boost >= self._boost_period:
+            self.boost()
+        return self._queue.next()
+
+    # every process goes back to the top level
+    def boost(self):
+        self._last_boost = HARDWARE.clock.tickNbr
+        self._levels.clear()
+        self._queue.merge_levels()
+        if log.enabled:
+            log.logger.info("MLFQ priority boost")
+
+    def quantum_expired(self, pcb):
+        self._levels[pcb.pid] = min(self.level(pcb) + 1, len(self._quanta) - 1)
+
+    def burst_finished(self, pcb):
+        super().burst_finished(pcb)
+        self._levels[pcb.pid] = max(self.level(pcb) - 1, 0)
+
+    def quantum_for(self, pcb):
+        return self._quanta[self.level(pcb)]
+
+    def check_preemptive(self):
+        return True
+
+    def preempts(self, pcb, current):
+        return self.level(pcb) < self.level(current)
+
     def print_ready(self):
-        for i in range(0, 5):
-            print(self._queue[i])
+        for level in range(0, self._queue.levels):
+            print(list(self._queue.level(level)))
+
+
+class CompletelyFairScheduler(SchedulingAlgorithm):
+    # The process with the lowest virtual runtime is allowed to run. The virtual runtime grows with the ticks on CPU
+    # divided by the weight of the priority, so every process gets a share of the CPU proportional to its weight
+    # The timeslice splits target_latency among the runnable processes by weight (min_granularity at least)
+    # A process that gets ready starts at the minimum virtual runtime, it can't save up CPU while it waits
+    # Preemptive (a process that gets ready takes the CPU if its virtual runtime is wakeup_granularity lower)
+
+    # weight of every priority (0 is the highest), each level gets 1.25 times the CPU of the next one
+    WEIGHTS = [1600, 1280, 1024, 819, 655]
+    NICE_0_WEIGHT = 1024
+
+    def __init__(self, kernel, target_latency=24, min_granularity=2, wakeup_granularity=2):
+        super().__init__(kernel)
+        self._target_latency = target_latency
+        self._min_granularity = min_granularity
+        self._wakeup_granularity = wakeup_granularity
+        self._min_vruntime = 0
+        self._ready_weight = 0
+        HARDWARE.timer.set_on(target_latency)
+
+    @property
+    def target_latency(self):
+        return self._target_latency
+
+    @property
+    def min_vruntime(self):
+        return self._min_vruntime
+
+    def new_ready_queue(self):
+        return HeapReadyQueue()
+
+    def weight(self, pcb):
+        return self.WEIGHTS[pcb.priority]
+
+    # a process can't be behind the minimum virtual runtime
+    def place(self, pcb):
+        pcb.vruntime = max(pcb.vruntime, self._min_vruntime)
+
+    def add(self, pcb):
+        self.place(pcb)
+        self._queue.add(pcb, pcb.vruntime)
+        self._ready_weight += self.weight(pcb)
+        self.kernel.change_state(pcb, "Ready")
+
+    def next(self):
+        pcb = self._queue.next()
+        self._ready_weight -= self.weight(pcb)
+        self._min_vruntime = max(self._min_vruntime, pcb.vruntime)
+        return pcb
+
+    def charge(self, pcb, ticks):
+        pcb.vruntime += ticks * self.NICE_0_WEIGHT / self.weight(pcb)
+
+    def quantum_for(self, pcb):
+        weight = self.weight(pcb)
+        timeslice = self._target_latency * weight // (self._ready_weight + weight)
+        return max(self._min_granularity, timeslice)
+
+    def check_preemptive(self):
+        return True
+
+    def preempts(self, pcb, current):
+        self.place(pcb)
+        running = HARDWARE.clock.tickNbr - current.dispatch_tick
+        current_vruntime = current.vruntime + running * self.NICE_0_WEIGHT / self.weight(current)
+        return pcb.vruntime + self._wakeup_granularity < current_vruntime
+
+
+class ProportionalShareScheduler(SchedulingAlgorithm):
+    # Every process holds tickets (TICKETS_PER_LEVEL for every level above the lowest priority) and gets a share
+    # of the CPU proportional to them
+    # A process that blocks for IO lends its own tickets to the process using the IO device (the one it waits for)
+    # until it gets ready again. Borrowed tickets are never lent again, so the total of tickets is kept
+    # Preemptive (every process runs for a quantum)
+
+    TICKETS_PER_LEVEL = 100
+
+    def __init__(self, kernel, quantum):
+        super().__init__(kernel)
+        self._tickets = {}
+        self._loans = {}
+        HARDWARE.timer.set_on(quantum)
+
+    def base_tickets(self, pcb):
+        return (5 - pcb.priority) * self.TICKETS_PER_LEVEL
+
+    # own tickets plus the borrowed ones
+    def tickets(self, pcb):
+        tickets = self._tickets.get(pcb.pid)
+        if tickets is None:
+            tickets = self.base_tickets(pcb)
+            self._tickets[pcb.pid] = tickets
+        return tickets
+
+    def set_tickets(self, pcb, tickets):
+        self._tickets[pcb.pid] = tickets
+        self.tickets_changed(pcb)
+
+    def tickets_changed(self, pcb):
+        pass
+
+    def add(self, pcb):
+        self.repay(pcb)
+        self.enqueue(pcb)
+        self.kernel.change_state(pcb, "Ready")
+
+    # a process back from IO may get the CPU without going through the ready queue
+    def set_current(self, pcb):
+        if pcb is not None:
+            self.repay(pcb)
+        super().set_current(pcb)
+
+    def blocked(self, pcb):
+        borrower = self.kernel.io_device_controller.current_pcb
+        if borrower is not None and borrower is not pcb:
+            tickets = self.base_tickets(pcb)
+            self._loans[pcb.pid] = (borrower, tickets)
+            self.set_tickets(borrower, self.tickets(borrower) + tickets)
+
+    # the process got its tickets back
+    def repay(self, pcb):
+        loan = self._loans.pop(pcb.pid, None)
+        if loan is not None:
+            borrower, tickets = loan
+            self.set_tickets(borrower, self.tickets(borrower) - tickets)
+
+
+class LotteryScheduler(ProportionalShareScheduler):
+    # Probabilistic proportional share: next draws a ticket among the ready processes
+
+    def __init__(self, kernel, quantum, seed=0):
+        self._seed = seed
+        super().__init__(kernel, quantum)
+
+    def new_ready_queue(self):
+        return LotteryReadyQueue(self._seed)
+
+    def enqueue(self, pcb):
+        self._queue.add(pcb, self.tickets(pcb))
+
+    def next(self):
+        return self._queue.next()
+
+    def tickets_changed(self, pcb):
+        self._queue.update(pcb, self.tickets(pcb))
+
+
+class StrideScheduler(ProportionalShareScheduler):
+    # Deterministic proportional share: the pass of a process advances its stride (STRIDE1 / tickets) for every
+    # tick on CPU and the process with the lowest pass runs. A process that gets ready can't be behind the pass
+    # of the last process that was picked
+
+    STRIDE1 = 1 << 20
+
+    def __init__(self, kernel, quantum):
+        super().__init__(kernel, quantum)
+        self._passes = {}
+        self._global_pass = 0
+
+    def new_ready_queue(self):
+        return HeapReadyQueue()
+
+    def stride(self, pcb):
+        return self.STRIDE1 // self.tickets(pcb)
+
+    def enqueue(self, pcb):
+        pass_value = max(self._passes.get(pcb.pid, 0), self._global_pass)
+        self._passes[pcb.pid] = pass_value
+        self._queue.add(pcb, pass_value)
+
+    def next(self):
+        pcb = self._queue.next()
+        self._global_pass = max(self._global_pass, self._passes[pcb.pid])
+        return pcb
+
+    def charge(self, pcb, ticks):
+        self._passes[pcb.pid] = self._passes.get(pcb.pid, self._global_pass) + ticks * self.stride(pcb)
+
+
+class ShortestJobFirst(SchedulingAlgorithm):
+    # The process with the shortest next CPU burst is allowed to run
+    # The burst is predicted with the exponential average of the CPU bursts of the process:
+    # prediction = alpha * last burst + (1 - alpha) * previous prediction (initial_burst at first)
+    # Non-preemptive
+
+    def __init__(self, kernel, alpha=0.5, initial_burst=5):
+        super().__init__(kernel)
+        self._alpha = alpha
+        self._initial_burst = initial_burst
+
+    @property
+    def alpha(self):
+        return self._alpha
+
+    @property
+    def initial_burst(self):
+        return self._initial_burst
+
+    def new_ready_queue(self):
+        return HeapReadyQueue()
+
+    def prediction(self, pcb):
+        if pcb.predicted_burst is None:
+            return self._initial_burst
+        return pcb.predicted_burst
+
+    # predicted ticks left of the current CPU burst
+    def remaining(self, pcb):
+        return max(0, self.prediction(pcb) - pcb.burst)
+
+    def add(self, pcb):
+        self._queue.add(pcb, self.remaining(pcb))
+        self.kernel.change_state(pcb, "Ready")
+
+    def next(self):
+        return self._queue.next()
+
+    def burst_finished(self, pcb):
+        pcb.predicted_burst = self._alpha * pcb.end_burst() + (1 - self._alpha) * self.prediction(pcb)
+
+
+class ShortestRemainingTimeFirst(ShortestJobFirst):
+    # The process with the shortest predicted remaining CPU burst is allowed to run
+    # Preemptive (a process that gets ready takes the CPU if its burst is shorter than what is left of the current one)
+
+    def check_preemptive(self):
+        return True
+
+    def preempts(self, pcb, current):
+        running = current.burst + HARDWARE.clock.tickNbr - current.dispatch_tick
+        return self.remaining(pcb) < max(0, self.prediction(current) - running)
 
 
 class PCBTable:
@@ -511,6 +1042,13 @@ class PCB:
         self._state = "New"
         self._pc = 0
         self._priority = random.randint(0, 4)
+        self._state_tick = HARDWARE.clock.tickNbr
+        self._arrival_tick = self._state_tick
+        self._waiting_ticks = 0
+        self._dispatch_tick = 0
+        self._burst = 0
+        self._predicted_burst = None
+        self._vruntime = 0
 
     @property
     def pid(self):
@@ -542,6 +1080,66 @@ class PCB:
     def priority(self):
         return self._priority
 
+    # tick of the last change of state
+    @property
+    def state_tick(self):
+        return self._state_tick
+
+    def set_state_tick(self, tick):
+        self._state_tick = tick
+
+    @property
+    def arrival_tick(self):
+        return self._arrival_tick
+
+    # ticks spent in the ready queue
+    @property
+    def waiting_ticks(self):
+        return self._waiting_ticks
+
+    def add_waiting_ticks(self, ticks):
+        self._waiting_ticks += ticks
+
+    # tick when the process was last loaded in the CPU
+    @property
+    def dispatch_tick(self):
+        return self._dispatch_tick
+
+    def set_dispatch_tick(self, tick):
+        self._dispatch_tick = tick
+
+    # ticks on CPU of the current CPU burst (it may take many dispatches)
+    @property
+    def burst(self):
+        return self._burst
+
+    def add_burst_ticks(self, ticks):
+        self._burst += ticks
+
+    # returns the length of the burst that finished
+    def end_burst(self):
+        burst = self._burst
+        self._burst = 0
+        return burst
+
+    # next CPU burst predicted by the scheduler, None before any prediction
+    @property
+    def predicted_burst(self):
+        return self._predicted_burst
+
+    @predicted_burst.setter
+    def predicted_burst(self, value):
+        self._predicted_burst = value
+
+    # ticks on CPU weighted by the priority (completely fair scheduler)
+    @property
+    def vruntime(self):
+        return self._vruntime
+
+    @vruntime.setter
+    def vruntime(self, value):
+        self._vruntime = value
+
     def __repr__(self):
         return "PCB ---> pid: {pid} program: {name} state: {state} " \
                "priority: {priority} pc: {pc}" \
@@ -564,37 +1162,32 @@ class Loader:
         return self._frame_size
 
     def load_page(self, pcb, page, frame):
-        log.logger.info("Loading page")
+        if log.enabled:
+            log.logger.info("Loading page")
         if self.kernel.memory_manager.page_is_in_swap(pcb.pid, page):
-            log.logger.info("Its in swap")
+            if log.enabled:
+                log.logger.info("Its in swap")
             swap_frame = self.kernel.memory_manager.get_current_frame(pcb.pid, page)
             instructions = self.swap_out(swap_frame)
-            self.kernel.swap_manager.release_frame(swap_frame)
-            self.kernel.memory_manager.set_swap_flag(pcb.pid, swap_frame, False)
+            self.kernel.memory_manager.set_swap_flag(pcb.pid, page, False)
         else:
-            log.logger.info("Its in disk")
+            if log.enabled:
+                log.logger.info("Its in disk")
             instructions = HARDWARE.disk.getPage(pcb.name, page, self.frame_size)
-        base_dir_memory = frame * self.frame_size
-        for instruction in instructions:
-            HARDWARE.memory.put(base_dir_memory, instruction)
-            base_dir_memory += 1
+        HARDWARE.memory.write_frame(frame, instructions)
+
+    # eager load: the pages are read from disk in a single batch
+    def load_pages(self, pcb, pages, frames):
+        instructions = HARDWARE.disk.getPages(pcb.name, pages, self.frame_size)
+        for page_instructions, frame in zip(instructions, frames):
+            HARDWARE.memory.write_frame(frame, page_instructions)
 
     def swap_in(self, victim_frame, swap_frame):
-        offset = 0
-        while offset < self.frame_size:
-            instruction = HARDWARE.memory.get(victim_frame * self.frame_size + offset)
-            HARDWARE.swap.put(swap_frame * self.frame_size + offset, instruction)
-            offset = offset + 1
+        HARDWARE.swap.write_frame(swap_frame, HARDWARE.memory.read_frame(victim_frame))
 
+    # returns a view of the swap frame, it must be copied before the frame is reused
     def swap_out(self, frame):
-        instructions = []
-        base_dir = frame * self.frame_size
-        counter = 0
-        while counter < self.frame_size:
-            instructions.append(HARDWARE.swap.get(base_dir))
-            counter += 1
-            base_dir += 1
-        return instructions
+        return HARDWARE.swap.read_frame(frame)
 
     def update_page_table(self, pid, page, frame, swap_is_on):
         self.kernel.memory_manager.update_page_table(pid, page, frame, swap_is_on)
@@ -610,17 +1203,23 @@ class Dispatcher:
     def kernel(self):
         return self._kernel
 
-    @staticmethod
-    def save(pcb):
+    # the ticks on CPU since the last load go to the CPU burst, which is over when the process waits for IO
+    def save(self, pcb):
         pcb.set_pc(HARDWARE.cpu.pc)
         HARDWARE.cpu.pc = -1
+        ticks = HARDWARE.clock.tickNbr - pcb.dispatch_tick
+        pcb.add_burst_ticks(ticks)
+        self.kernel.scheduler.charge(pcb, ticks)
+        if pcb.state == "Waiting":
+            self.kernel.scheduler.burst_finished(pcb)
 
     def load(self, pcb):
+        pcb.set_dispatch_tick(HARDWARE.clock.tickNbr)
         table = self.kernel.memory_manager.find_table(pcb.pid)
-        HARDWARE.mmu.page_table = table
+        HARDWARE.mmu.switch_context(table, pcb.pid)
         HARDWARE.cpu.pc = pcb.pc
         if self._kernel.has_running():
-            HARDWARE.timer.reset()
+            HARDWARE.timer.reset(self.kernel.scheduler.quantum_for(pcb))
 
     @staticmethod
     def start():
@@ -639,28 +1238,91 @@ class Dispatcher:
             self.load(pcb)
             self._kernel.change_state(pcb, "Running")
 
-    @staticmethod
-    def get_page_table():
-        return HARDWARE.mmu.page_table
-
-    @staticmethod
-    def set_page_table(new_table):
-        HARDWARE.mmu.page_table = new_table
-
     @staticmethod
     def get_clock_tick():
         return HARDWARE.clock.tickNbr
 
 
+# Allocator of the frames of a storage (memory or swap), every operation is O(1)
+# Frames never used are handed out in order (up to the high water mark), released frames are
+# queued in a deque and reused after them, and a bitmap tells which frames are in use.
+class FrameAllocator:
+
+    def __init__(self, frames_number):
+        self._frames_number = frames_number
+        self._high_water_mark = 0
+        self._released = deque()
+        self._used = bytearray(frames_number)
+        self._used_count = 0
+
+    @property
+    def frames_number(self):
+        return self._frames_number
+
+    @property
+    def free_count(self):
+        return self._frames_number - self._used_count
+
+    @property
+    def used_count(self):
+        return self._used_count
+
+    def has_free(self):
+        return self._used_count < self._frames_number
+
+    # returns a free frame, None if there are none
+    def allocate(self):
+        if self._high_water_mark < self._frames_number:
+            frame = self._high_water_mark
+            self._high_water_mark += 1
+        elif self._released:
+            frame = self._released.popleft()
+        else:
+            return None
+        self._used[frame] = 1
+        self._used_count += 1
+        return frame
+
+    # returns n free frames (i.e. for a whole program), None if there are not enough
+    def allocate_many(self, n):
+        if n > self.free_count:
+            return None
+        return [self.allocate() for index in range(0, n)]
+
+    # returns False if the frame was not in use
+    def release(self, frame):
+        if not self._used[frame]:
+            return False
+        self._used[frame] = 0
+        self._used_count -= 1
+        self._released.append(frame)
+        return True
+
+    # the lists are only built for display
+    def free_frames(self):
+        return list(range(self._high_water_mark, self._frames_number)) + list(self._released)
+
+    def used_frames(self):
+        return [frame for frame in range(0, self._high_water_mark) if self._used[frame]]
+
+
+# The memory managers own the page table of every process, the MMU only borrows the table of the running one
+# Code pages are read only: the processes running the same program share the frames of its pages, keyed on
+# (program, page). The owners of every frame are in the inverted table, a frame is free when it has none left
 class MemoryManager:
 
-    def __init__(self, kernel, frame_size, memory_size):
+    # page_table_levels = 1 uses flat page tables, 2 or more multi level tables
+    def __init__(self, kernel, frame_size, memory_size, page_table_levels=1):
         self._kernel = kernel
         self._page_table = {}
+        self._page_table_levels = page_table_levels
+        self._inverted_table = InvertedPageTable()
         self._frame_size = frame_size
-        self._free_memory = memory_size
-        self._free_frames = []
-        self._used_frames = []
+        self._frames = FrameAllocator(memory_size // frame_size)
+        self._share_pages = True
+        self._shared_frames = {}
+        self._frame_pages = {}
+        self._shared_mappings = 0
 
     @property
     def kernel(self):
@@ -670,86 +1332,136 @@ class MemoryManager:
     def page_table(self):
         return self._page_table
 
+    @property
+    def inverted_table(self):
+        return self._inverted_table
+
+    @property
+    def page_table_levels(self):
+        return self._page_table_levels
+
+    def new_page_table(self, pages_number):
+        if self._page_table_levels == 1:
+            return PageTable(pages_number)
+        return MultiLevelPageTable(pages_number, self._page_table_levels)
+
+    # memory taken by the page table of every process
+    def page_table_footprint(self):
+        return {pid: table.footprint() for pid, table in self.page_table.items()}
+
+    @property
+    def share_pages(self):
+        return self._share_pages
+
+    @share_pages.setter
+    def share_pages(self, value):
+        self._share_pages = value
+
+    # the frame with the page of the program, None if it is not in memory
+    def shared_frame(self, program, page):
+        if not self._share_pages:
+            return None
+        return self._shared_frames.get((program, page))
+
+    def share_frame(self, frame, program, page):
+        if self._share_pages:
+            self._shared_frames[(program, page)] = frame
+            self._frame_pages[frame] = (program, page)
+
+    def unshare_frame(self, frame):
+        key = self._frame_pages.pop(frame, None)
+        if key is not None:
+            del self._shared_frames[key]
+
+    def sharing_stats(self):
+        return {"share_pages": self._share_pages, "shared_pages": len(self._shared_frames),
+                "shared_mappings": self._shared_mappings}
+
+    # returns the (pid, page) that owns the frame, None if the frame is free
+    def find_frame_owner(self, frame_number):
+        return self.inverted_table.owner(frame_number)
+
+    # (page table, page) of every process using the frame
+    def frame_entries(self, frame):
+        return [(self.page_table[pid], page) for pid, page in self.inverted_table.owners(frame)]
+
     @property
     def frame_size(self):
         return self._frame_size
 
     @property
-    def free_memory(self):
-        return self._free_memory
+    def frames(self):
+        return self._frames
 
-    @free_memory.setter
-    def free_memory(self, value):
-        self._free_memory = value
+    # the clock the page replacement algorithms take the time from
+    @property
+    def clock(self):
+        return HARDWARE.clock
+
+    @property
+    def free_memory(self):
+        return self.frames.free_count * self.frame_size
 
     @property
     def free_frames(self):
-        return self._free_frames
+        return self.frames.free_frames()
 
     @property
     def used_frames(self):
-        return self._used_frames
+        return self.frames.used_frames()
 
     def assign_frames(self):
-        frames_number = self._free_memory / self.frame_size
-        for index in range(0, int(frames_number)):
-            self._free_frames.append(index)
         HARDWARE.mmu.frame_size = self.frame_size
+        HARDWARE.memory.frame_size = self.frame_size
+        HARDWARE.disk.frame_size = self.frame_size
 
 
 class MemoryManagerPagination(MemoryManager):
 
-    def __init__(self, kernel, frame_size, memory_size):
-        super().__init__(kernel, frame_size, memory_size)
+    def __init__(self, kernel, frame_size, memory_size, page_table_levels=1):
+        super().__init__(kernel, frame_size, memory_size, page_table_levels)
         self.assign_frames()
 
     def next_frame(self):
-        frame = self.free_frames.pop(0)
-        self.free_memory = self.free_memory - self.frame_size
-        self.used_frames.append(frame)
-        return frame
+        return self.frames.allocate()
 
     def find_table(self, pid):
-        table = self.page_table[pid]
-        res = table.clone()
-        return res
+        return self.page_table[pid]
 
     def has_enough_space(self, program_size):
         return self.free_memory >= program_size
 
     def release_space(self, pid):
-        used_frames = self.process_used_frames(pid)
-        self.free_memory = self.free_memory + len(used_frames) * self.frame_size
-        for frame in used_frames:
-            self.used_frames.remove(frame)
-            self.free_frames.append(frame)
-
-    def process_used_frames(self, pid):
-        page_table = self.find_table(pid)
-        final_list = []
-        for key, value in page_table.page_list.items():
-            final_list.append(value[0])
-        return final_list
+        HARDWARE.mmu.invalidate_asid(pid)
+        for page, frame in list(self.find_table(pid).loaded_pages()):
+            if not self.inverted_table.unmap_owner(frame, pid, page):
+                self.unshare_frame(frame)
+                self.frames.release(frame)
 
     def create_page_table(self, pcb, program):
-        program_length = len(program.instructions)
-        if self.has_enough_space(program_length):
-            pair_div_mod = divmod(program_length, self.frame_size)
-            pages_number = pair_div_mod[0]
-            log.logger.info("Number of pages:" + str(pages_number))
-            table = PageTable()
-            for page in range(0, int(pages_number)):
-                table.add(page, self.next_frame())
+        # the disk index keeps the number of pages of every program
+        pages_number = HARDWARE.disk.pages(program.name)
+        new_pages = [page for page in range(0, pages_number) if self.shared_frame(program.name, page) is None]
+        if self.has_enough_space(len(new_pages) * self.frame_size):
+            log.logger.info("Number of pages: %s", pages_number)
+            table = self.new_page_table(pages_number)
+            for page in range(0, pages_number):
+                frame = self.shared_frame(program.name, page)
+                if frame is not None:
+                    table.update(page, frame)
+                    self.inverted_table.map(frame, pcb.pid, page)
+                    self._shared_mappings += 1
+            frames = self.frames.allocate_many(len(new_pages))
+            for page, frame in zip(new_pages, frames):
+                table.update(page, frame)
+                self.inverted_table.map(frame, pcb.pid, page)
+                self.share_frame(frame, program.name, page)
             self.page_table[pcb.pid] = table
-            self.load_all_pages(table, pcb)
+            self.kernel.loader.load_pages(pcb, new_pages, frames)
         else:
             log.logger.info("The amount of empty space is insufficient to load this program")
             raise SystemExit
 
-    def load_all_pages(self, table, pcb):
-        for key, value in table.page_list.items():
-            self.kernel.loader.load_page(pcb, key, value[0])
-
     def page_is_in_swap(self, pid, page):
         return False
 
@@ -763,107 +1475,275 @@ class MemoryManagerPagination(MemoryManager):
 
 class MemoryManagerPaginationOnDemand(MemoryManager):
 
-    def __init__(self, kernel, frame_size, memory_size):
-        super().__init__(kernel, frame_size, memory_size)
-        self._victim_selector = SecondChanceReplacementAlgorithm(self)
+    def __init__(self, kernel, frame_size, memory_size, page_table_levels=1):
+        super().__init__(kernel, frame_size, memory_size, page_table_levels)
         self.assign_frames()
+        self._evictions = 0
+        self._read_ahead = 0
+        self._prefetch_cap = None
+        self._streams = {}
+        self._prefetched = OrderedDict()
+        self._prefetches = 0
+        self._prefetch_hits = 0
+        self._prefetch_wasted = 0
+        self.victim_selector = SecondChanceReplacementAlgorithm(self)
+        self._programs = {}
+        self._discard_clean_pages = True
+        self._swap_outs = 0
+        self._discarded = 0
+        self._pageout = None
 
     @property
     def victim_selector(self):
         return self._victim_selector
 
+    # frames taken from a process to load another page
+    @property
+    def evictions(self):
+        return self._evictions
+
+    # a clean victim is the same as its page in the disk: it is dropped instead of written to swap
+    @property
+    def discard_clean_pages(self):
+        return self._discard_clean_pages
+
+    @discard_clean_pages.setter
+    def discard_clean_pages(self, value):
+        self._discard_clean_pages = value
+
+    @property
+    def pageout(self):
+        return self._pageout
+
+    # starts evicting victims in the background while there are less free frames than low_watermark
+    def start_pageout(self, low_watermark, batch):
+        self._pageout = PageoutDaemon(self, low_watermark, batch)
+        HARDWARE.add_suscriber(self._pageout)
+
+    # the page replacement algorithm can be replaced before executing any program
+    @victim_selector.setter
+    def victim_selector(self, algorithm):
+        self._victim_selector = algorithm
+        self.update_access_hook()
+
+    # the MMU reports the accesses to the page replacement algorithm if it follows them and, with
+    # read ahead, to the memory manager so the first access of a prefetched page counts as a hit
+    def update_access_hook(self):
+        if self._read_ahead:
+            HARDWARE.mmu.on_access = self.access
+        elif self._victim_selector.tracks_accesses():
+            HARDWARE.mmu.on_access = self._victim_selector.touch
+        else:
+            HARDWARE.mmu.on_access = None
+
+    def access(self, frame):
+        self._victim_selector.touch(frame)
+        if frame in self._prefetched:
+            del self._prefetched[frame]
+            self._prefetch_hits += 1
+
     def next_frame(self):
-        if len(self.free_frames) > 0:
-            frame = self.free_frames.pop(0)
-            # self.victim_selector.add_frame(frame)
-            self.free_memory = self.free_memory - self.frame_size
-            self.used_frames.append(frame)
+        if self.frames.has_free():
+            frame = self.frames.allocate()
         else:
-            swap_frame = self.kernel.swap_manager.next_frame()
-            victim_frame = self.victim_selector.get_victim()
-            self.kernel.loader.swap_in(victim_frame, swap_frame)
-            owner = self.find_frame_owner(victim_frame)
-            table = self.find_table(owner)
-            table.set_swap(victim_frame, True)
-            table.set_new_frame(victim_frame, swap_frame)
-            self.release_frame(victim_frame)
+            self.evict()
             frame = self.next_frame()
         return frame
 
+    # frees the frame of a victim: a dirty page is written to swap, a clean one is dropped and read from
+    # the disk on its next page fault
+    def evict(self):
+        victim_frame = self.victim_selector.get_victim()
+        self._evictions += 1
+        HARDWARE.mmu.invalidate_frame(victim_frame)
+        owners = self.inverted_table.unmap(victim_frame)
+        if self._discard_clean_pages and not any(self.page_table[owner].is_dirty(page) for owner, page in owners):
+            self._discarded += 1
+            for owner, page in owners:
+                self.page_table[owner].unload(page)
+        else:
+            swap_frame = self.kernel.swap_manager.next_frame()
+            self.kernel.loader.swap_in(victim_frame, swap_frame)
+            self._swap_outs += 1
+            # every process sharing the frame finds the page in the same swap frame
+            for owner, page in owners:
+                table = self.page_table[owner]
+                table.set_swap(page, True)
+                table.clear_dirty(page)
+                table.update(page, swap_frame)
+                self.inverted_table.map(swap_frame, owner, page, True)
+        self.release_frame(victim_frame)
+
+    def pageout_stats(self):
+        return {"swap_outs": self._swap_outs, "discarded": self._discarded,
+                "background_evictions": self._pageout.evictions if self._pageout is not None else 0}
+
     def create_page_table(self, pcb, program):
-        program_size = len(program.instructions)
-        pair_div_mod = divmod(program_size, self.frame_size)
-        pages_number = pair_div_mod[0]
-        if pair_div_mod[1] != 0:
-            pages_number += 1
-        table = PageTable()
-        for page in range(0, int(pages_number)):
-            table.add(page, None)
-        self.page_table[pcb.pid] = table
+        # the disk index keeps the number of pages of every program
+        pages_number = HARDWARE.disk.pages(program.name)
+        self.page_table[pcb.pid] = self.new_page_table(pages_number)
+        self._programs[pcb.pid] = program.name
 
     def find_table(self, pid):
-        table = self.page_table[pid].clone()
-        return table
-
-    def switch_table(self, pid, new_table):
-        self.page_table[pid] = new_table
+        return self.page_table[pid]
 
     def has_enough_space(self, program_size):
         return self.free_memory >= program_size
 
     def release_space(self, pid):
+        HARDWARE.mmu.invalidate_asid(pid)
         table = self.find_table(pid)
-        for key, value in table.page_list.items():
-            if not value[1]:
-                self.release_frame(value[0])
-            else:
-                self.kernel.swap_manager.release_frame(value[0])
+        for page, swap_frame in list(table.swapped_pages()):
+            self.leave_swap_frame(swap_frame, pid, page)
+        for page, frame in list(table.loaded_pages()):
+            self.leave_frame(frame, pid, page)
         table.reset()
+        self._streams.pop(pid, None)
 
     def update_page_table(self, pid, page, frame):
         table = self.page_table[pid]
         table.update(page, frame)
-
-    def find_frame_owner(self, frame_number):
-        owner = None
-        for key, value in self.page_table.items():
-            if value.owns_frame(frame_number):
-                owner = key
-        return owner
+        self.inverted_table.map(frame, pid, page)
+        self.share_frame(frame, self._programs[pid], page)
+
+    # maps the page if another process running the same program has it in memory, False if none has it
+    def map_shared_page(self, pid, page):
+        frame = self.shared_frame(self._programs[pid], page)
+        if frame is None:
+            return False
+        table = self.page_table[pid]
+        if table.is_in_swap(page):
+            self.set_swap_flag(pid, page, False)
+        table.update(page, frame)
+        self.update_table_flags(pid, page)
+        self.inverted_table.map(frame, pid, page)
+        self._shared_mappings += 1
+        return True
+
+    # the process stops using the frame, which is released when no other process shares it
+    def leave_frame(self, frame, pid, page):
+        followed = self.inverted_table.owner(frame)
+        owners = self.inverted_table.unmap_owner(frame, pid, page)
+        if not owners:
+            self.release_frame(frame)
+        elif followed == (pid, page):
+            # the page replacement algorithm follows the frame through its first owner
+            other_pid, other_page = owners[0]
+            self.victim_selector.change_owner(frame, self.page_table[other_pid], other_page, other_pid)
+            if frame in self._prefetched:
+                self._prefetched[frame] = other_pid
+
+    def leave_swap_frame(self, swap_frame, pid, page):
+        if not self.inverted_table.unmap_owner(swap_frame, pid, page, True):
+            self.kernel.swap_manager.release_frame(swap_frame)
 
     def release_frame(self, frame):
-        if frame in self.used_frames:
-            self.used_frames.remove(frame)
-            self.free_frames.append(frame)
-            self.free_memory += self.frame_size
+        pid = self._prefetched.pop(frame, None)
+        if pid is not None:
+            self.prefetched_page_released(pid)
+        self.inverted_table.unmap(frame)
+        self.unshare_frame(frame)
+        self.victim_selector.remove_frame(frame)
+        self.frames.release(frame)
+
+    # Read ahead: after a fault the next pages of the program on disk are loaded too, in free frames only
+    # (prefetching never evicts a page). The window of a process doubles while its faults are sequential
+    # (up to read_ahead pages), goes back to one page after a jump and halves when a prefetched page is
+    # wasted. At most prefetch_cap frames hold prefetched pages that were not referenced yet (None, the
+    # default, leaves only the free frames as the limit)
+    @property
+    def read_ahead(self):
+        return self._read_ahead
 
-    def get_table(self, pid):
-        return self.page_table[pid]
+    @read_ahead.setter
+    def read_ahead(self, pages):
+        self._read_ahead = pages
+        self.update_access_hook()
 
-    def set_swap_flag(self, pid, frame, boolean):
+    @property
+    def prefetch_cap(self):
+        return self._prefetch_cap
+
+    @prefetch_cap.setter
+    def prefetch_cap(self, frames):
+        self._prefetch_cap = frames
+
+    def prefetch(self, pcb, page):
+        if self._read_ahead == 0:
+            return
+        expected, window = self._streams.get(pcb.pid, (None, 0))
+        free = self.frames.free_count
+        if self._prefetch_cap is not None:
+            free = min(free, self._prefetch_cap - len(self._prefetched))
+        if free <= 0:
+            # nothing can be read ahead: the stream follows the fault but its window doesn't grow
+            self._streams[pcb.pid] = (page + 1, window if page == expected else 1)
+            return
+        if page == expected:
+            window = min(max(1, window * 2), self._read_ahead)
+        else:
+            window = 1
+        budget = min(window, free)
+        table = self.page_table[pcb.pid]
+        pages = []
+        next_page = page + 1
+        while len(pages) < budget and next_page < table.pages_number:
+            if table.find_frame(next_page) is None and not self.map_shared_page(pcb.pid, next_page):
+                pages.append(next_page)
+            next_page += 1
+        self._streams[pcb.pid] = (next_page, window)
+        if not pages:
+            return
+        frames = self.frames.allocate_many(len(pages))
+        self.kernel.loader.load_pages(pcb, pages, frames)
+        for prefetched_page, frame in zip(pages, frames):
+            self.add_possible_victim(frame, prefetched_page, pcb.pid)
+            self.update_page_table(pcb.pid, prefetched_page, frame)
+            # not referenced yet: the MMU sets the bit on the first access
+            table.clear_reference(prefetched_page)
+            self._prefetched[frame] = pcb.pid
+        self._prefetches += len(pages)
+        if log.enabled:
+            log.logger.info("Read ahead of pages %s (window %s)", pages, window)
+
+    # a prefetched page released before its first access was wasted
+    def prefetched_page_released(self, pid):
+        self._prefetch_wasted += 1
+        stream = self._streams.get(pid)
+        if stream is not None:
+            self._streams[pid] = (stream[0], stream[1] // 2)
+
+    def prefetch_stats(self):
+        return {"read_ahead": self._read_ahead, "prefetch_cap": self._prefetch_cap,
+                "prefetched": self._prefetches, "hits": self._prefetch_hits, "wasted": self._prefetch_wasted}
+
+    # the page leaves the swap (False) or goes to the swap (True)
+    def set_swap_flag(self, pid, page, boolean):
         table = self.page_table[pid]
-        table.set_swap(frame, boolean)
+        if not boolean:
+            self.leave_swap_frame(table.find_frame(page), pid, page)
+            # without its swap copy the page in memory is the only one with its content
+            table.set_dirty(page)
+        table.set_swap(page, boolean)
 
     def page_is_in_swap(self, pid, page):
-        table = self.page_table[pid]
-        page_info = table.page_list[page]
-        return page_info[1]
+        return self.page_table[pid].is_in_swap(page)
 
     def get_current_frame(self, pid, page):
-        table = self.find_table(pid)
-        page_info = table.page_list[page]
-        return page_info[0]
+        return self.page_table[pid].find_frame(page)
+
+    def page_fault(self, pid):
+        self.victim_selector.fault(pid)
 
     def add_possible_victim(self, frame, page, pid):
-        page_info = self.update_table_flags(pid, page)
-        self.victim_selector.add_frame(frame, page_info)
+        table = self.update_table_flags(pid, page)
+        self.victim_selector.add_frame(frame, table, page, pid)
 
     def update_table_flags(self, pid, page):
         table = self.find_table(pid)
-        page_info = table.page_list[page]
-        page_info[2] = self.kernel.dispatcher.get_clock_tick()
-        page_info[3] = 1
-        return page_info
+        table.set_timestamp(page, self.kernel.dispatcher.get_clock_tick())
+        table.reference(page)
+        return table
 
     def __repr__(self):
         string = ""
@@ -878,14 +1758,11 @@ class SwapManager:
     def __init__(self, kernel, frame_size):
         self._kernel = kernel
         self._frame_size = frame_size
-        self._free_frames = []
-        self._used_frames = []
+        self._frames = FrameAllocator(HARDWARE.swap.size // frame_size)
         self.assign_frames()
 
     def assign_frames(self):
-        frames_number = HARDWARE.swap.size / self.frame_size
-        for index in range(0, int(frames_number)):
-            self.free_frames.append(index)
+        HARDWARE.swap.frame_size = self.frame_size
 
     @property
     def kernel(self):
@@ -895,33 +1772,80 @@ class SwapManager:
     def frame_size(self):
         return self._frame_size
 
+    @property
+    def frames(self):
+        return self._frames
+
     @property
     def free_frames(self):
-        return self._free_frames
+        return self.frames.free_frames()
 
     @property
     def used_frames(self):
-        return self._used_frames
+        return self.frames.used_frames()
 
     def next_frame(self):
-        frame = None
-        try:
-            frame = self.free_frames.pop(0)
-        except IndexError:
+        frame = self.frames.allocate()
+        if frame is None:
             log.logger.info("ERROR: there are no empty frames in swap")
             sys.exit("SYSTEM SHUTTING DOWN...")
-        self.used_frames.append(frame)
         return frame
 
     def release_frame(self, frame):
-        self.used_frames.remove(frame)
-        self.free_frames.append(frame)
+        if not self.frames.release(frame):
+            raise ValueError("Swap frame {frame} is not in use".format(frame=frame))
 
     def __repr__(self):
         return "SWAP MANAGER\nFree frames: {free} \nUsed frames: {used}"\
             .format(free=self.free_frames, used=self.used_frames)
 
 
+# Background pageout: on every tick evicts up to batch victims while there are less free frames than
+# low_watermark, so the page faults find a free frame instead of waiting for an eviction
+class PageoutDaemon:
+
+    def __init__(self, memory_manager, low_watermark, batch):
+        self._memory_manager = memory_manager
+        self._low_watermark = low_watermark
+        self._batch = batch
+        self._evictions = 0
+
+    @property
+    def low_watermark(self):
+        return self._low_watermark
+
+    @property
+    def batch(self):
+        return self._batch
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    # only the frames in use have a victim to evict
+    def needs_pageout(self):
+        frames = self._memory_manager.frames
+        return frames.free_count < self._low_watermark and frames.used_count > 0
+
+    def tick(self, tickNbr):
+        evicted = 0
+        while evicted < self._batch and self.needs_pageout():
+            self._memory_manager.evict()
+            evicted += 1
+        self._evictions += evicted
+        if log.enabled and evicted > 0:
+            log.logger.info("Pageout: %s frames released", evicted)
+
+    ## ticks until the next pageout, None while there are enough free frames
+    def next_event(self, tickNbr):
+        if self.needs_pageout():
+            return 0
+        return None
+
+    def skip(self, ticks):
+        pass
+
+
 class PageReplacementAlgorithm:
 
     def __init__(self, memory_manager):
@@ -931,50 +1855,110 @@ class PageReplacementAlgorithm:
     def memory_manager(self):
         return self._memory_manager
 
+    # algorithms that need to know every memory reference get their touch() called by the MMU
+    def tracks_accesses(self):
+        return False
+
+    def touch(self, frame):
+        pass
+
+    # the MMU sets the reference bit in the table of the running process, so a frame shared by many
+    # processes was referenced if any of them referenced it. The bits of all of them are cleared
+    def clear_frame_reference(self, frame):
+        referenced = False
+        for table, page in self.memory_manager.frame_entries(frame):
+            if table.is_referenced(page):
+                table.clear_reference(page)
+                referenced = True
+        return referenced
+
+    # the last use of a shared frame is the last use of any of its processes
+    def frame_timestamp(self, frame):
+        return max(table.timestamp(page) for table, page in self.memory_manager.frame_entries(frame))
+
+    def set_frame_timestamp(self, frame, tick):
+        for table, page in self.memory_manager.frame_entries(frame):
+            table.set_timestamp(page, tick)
+
+    # the frame was released (its process finished or it was the victim)
+    def remove_frame(self, frame):
+        pass
+
+    # a page fault of the process (the page may be loaded or mapped from another process)
+    def fault(self, pid):
+        pass
+
+    # the frame stays in memory for another process sharing it (its first owner finished)
+    def change_owner(self, frame, table, page, pid):
+        self.remove_frame(frame)
+        self.add_frame(frame, table, page, pid)
+
+    # per process measures of the algorithm, None if it has none
+    def stats(self):
+        return None
+
 
 class FIFOPageReplacementAlgorithm(PageReplacementAlgorithm):
+    # The frames in the order their pages were loaded, a released frame leaves the queue in O(1)
 
     def __init__(self, memory_manager):
         super().__init__(memory_manager)
-        self._frames_used = []
+        self._frames_used = OrderedDict()
 
     @property
     def frames_used(self):
         return self._frames_used
 
-    def add_frame(self, frame, page_info):
-        self._frames_used.append(frame)
+    def add_frame(self, frame, table, page, pid):
+        self._frames_used.pop(frame, None)
+        self._frames_used[frame] = (pid, page)
+
+    def remove_frame(self, frame):
+        self._frames_used.pop(frame, None)
+
+    # the page was loaded when it was, the frame keeps its place in the queue
+    def change_owner(self, frame, table, page, pid):
+        self._frames_used[frame] = (pid, page)
 
     def get_victim(self):
-        return self._frames_used.pop(0)
+        victim, owner = self._frames_used.popitem(last=False)
+        return victim
 
     def __repr__(self):
         return "FIFO MEMORY ALGORITHM\nFrames: {frames}".format(frames=self.frames_used)
 
 
 class LRUPageReplacementAlgorithm(PageReplacementAlgorithm):
+    # The frames are ordered from the least to the most recently used: the MMU moves a frame
+    # to the end on every access, so touching a frame and choosing the victim are O(1)
 
     def __init__(self, memory_manager):
         super().__init__(memory_manager)
-        self._frames_used = {}
+        self._frames_used = OrderedDict()
 
     @property
     def frames_used(self):
         return self._frames_used
 
-    def add_frame(self, frame, page_info):
-        self.frames_used[frame] = page_info
+    def tracks_accesses(self):
+        return True
+
+    def add_frame(self, frame, table, page, pid):
+        self.frames_used[frame] = (pid, page)
+        self.frames_used.move_to_end(frame)
+
+    def touch(self, frame):
+        self._frames_used.move_to_end(frame)
+
+    def remove_frame(self, frame):
+        self._frames_used.pop(frame, None)
+
+    # the frame keeps its last use
+    def change_owner(self, frame, table, page, pid):
+        self._frames_used[frame] = (pid, page)
 
     def get_victim(self):
-        first_key = list(self.frames_used.keys())[0]
-        first_frame_info = self.frames_used[0]
-        victim = first_key
-        minimum = first_frame_info[2]
-        for key, value in self.frames_used.items():
-            if value[2] < minimum:
-                minimum = value[2]
-                victim = key
-        del self.frames_used[victim]
+        victim, owner = self.frames_used.popitem(last=False)
         return victim
 
     def __repr__(self):
@@ -982,107 +1966,566 @@ class LRUPageReplacementAlgorithm(PageReplacementAlgorithm):
 
 
 class SecondChanceReplacementAlgorithm(PageReplacementAlgorithm):
+    # Clock version of second chance: a circular array with the (table, page) of every frame and a hand
+    # going around it. The MMU sets the reference bit on every access and the hand clears the bits
+    # it passes over until it finds a page without it (so choosing a victim is amortised O(1))
+    # A shared frame gets a second chance if any of the processes sharing it referenced it
 
     def __init__(self, memory_manager):
         super().__init__(memory_manager)
-        self._frames_used = []
+        self._frames_used = [None] * memory_manager.frames.frames_number
+        self._hand = 0
+
+    @property
+    def frames_used(self):
+        return self._frames_used
+
+    @property
+    def hand(self):
+        return self._hand
+
+    def add_frame(self, frame, table, page, pid):
+        self._frames_used[frame] = (table, page)
+
+    def remove_frame(self, frame):
+        self._frames_used[frame] = None
+
+    def get_victim(self):
+        frames_used = self._frames_used
+        hand = self._hand
+        while True:
+            frame = hand
+            entry = frames_used[frame]
+            hand += 1
+            if hand == len(frames_used):
+                hand = 0
+            if entry is None:
+                continue
+            if not self.clear_frame_reference(frame):
+                frames_used[frame] = None
+                self._hand = hand
+                if log.enabled:
+                    log.logger.info("La victima elegida es %s, la aguja quedo en %s", frame, hand)
+                return frame
+
+    def __repr__(self):
+        return "SECOND CHANCE (CLOCK) MEMORY ALGORITHM\nHand: {hand}\n{frames}"\
+            .format(hand=self.hand, frames=self.frames_used)
+
+
+# Base of the working set algorithms: the working set of a process are the pages it referenced in the
+# last `window` ticks. Keeps the owner of every frame, the resident set size and the faults of every process
+class AbstractWorkingSetAlgorithm(PageReplacementAlgorithm):
+
+    def __init__(self, memory_manager, window):
+        super().__init__(memory_manager)
+        self._window = window
+        self._clock = memory_manager.clock
+        self._owners = {}
+        self._resident = {}
+        self._faults = {}
+        self._first_fault = {}
+
+    @property
+    def window(self):
+        return self._window
+
+    def add_frame(self, frame, table, page, pid):
+        self.remove_frame(frame)
+        self._owners[frame] = pid
+        self._resident[pid] = self._resident.get(pid, 0) + 1
+
+    # read ahead and shared pages don't go through a page fault of the process, so they are counted apart
+    def fault(self, pid):
+        self._faults[pid] = self._faults.get(pid, 0) + 1
+        self._first_fault.setdefault(pid, self._clock.tickNbr)
+
+    # returns the pid that owned the frame (None if it had no owner)
+    def remove_frame(self, frame):
+        pid = self._owners.pop(frame, None)
+        if pid is not None:
+            self._resident[pid] -= 1
+        return pid
+
+    def resident_set_size(self, pid):
+        return self._resident.get(pid, 0)
+
+    # pages of the process referenced in the last window ticks
+    def working_set_size(self, pid):
+        log.logger.error("-- WORKING_SET_SIZE MUST BE OVERRIDE in class {classname}"
+                         .format(classname=self.__class__.__name__))
+        return 0
+
+    # page faults per tick since the first fault of the process
+    def fault_rate(self, pid):
+        faults = self._faults.get(pid, 0)
+        if faults == 0:
+            return 0
+        return faults / (self._clock.tickNbr - self._first_fault[pid] + 1)
+
+    def stats(self):
+        return {pid: {"resident_set_size": self.resident_set_size(pid),
+                      "working_set_size": self.working_set_size(pid),
+                      "faults": self._faults.get(pid, 0), "fault_rate": self.fault_rate(pid)}
+                for pid in sorted(set(self._faults.keys()) | set(self._resident.keys()))}
+
+
+class WorkingSetReplacementAlgorithm(AbstractWorkingSetAlgorithm):
+    # The MMU tells the last use of every frame and the resident frames of each process are ordered from the
+    # least to the most recently used. The victim is the oldest page out of every working set or, when all the
+    # resident pages are in a working set, the least recently used page of the biggest resident set
+
+    def __init__(self, memory_manager, window=50):
+        super().__init__(memory_manager, window)
+        self._last_use = {}
+
+    def tracks_accesses(self):
+        return True
+
+    def add_frame(self, frame, table, page, pid):
+        super().add_frame(frame, table, page, pid)
+        frames = self._last_use.setdefault(pid, OrderedDict())
+        frames[frame] = self._clock.tickNbr
+
+    def remove_frame(self, frame):
+        pid = super().remove_frame(frame)
+        if pid is not None:
+            frames = self._last_use[pid]
+            del frames[frame]
+            if not frames:
+                del self._last_use[pid]
+        return pid
+
+    def touch(self, frame):
+        frames = self._last_use[self._owners[frame]]
+        frames[frame] = self._clock.tickNbr
+        frames.move_to_end(frame)
+
+    def working_set_size(self, pid):
+        now = self._clock.tickNbr
+        size = 0
+        for last_use in reversed(self._last_use.get(pid, {}).values()):
+            if now - last_use > self.window:
+                break
+            size += 1
+        return size
+
+    def get_victim(self):
+        now = self._clock.tickNbr
+        oldest = None
+        oldest_use = None
+        biggest = None
+        for pid, frames in self._last_use.items():
+            frame, last_use = next(iter(frames.items()))
+            if now - last_use > self.window and (oldest is None or last_use < oldest_use):
+                oldest = frame
+                oldest_use = last_use
+            if biggest is None or len(frames) > len(self._last_use[biggest]):
+                biggest = pid
+        if oldest is None:
+            oldest = next(iter(self._last_use[biggest]))
+        self.remove_frame(oldest)
+        if log.enabled:
+            log.logger.info("La victima elegida es %s (fuera del working set: %s)", oldest,
+                            oldest_use is not None)
+        return oldest
+
+    def __repr__(self):
+        return "WORKING SET MEMORY ALGORITHM\nWindow: {window}\n{frames}"\
+            .format(window=self.window, frames=self._last_use)
+
+
+class WSClockReplacementAlgorithm(AbstractWorkingSetAlgorithm):
+    # The clock of second chance with the time of the last use of every page (its timestamp). The hand refreshes
+    # the time of the referenced pages (clearing their bit) and takes the first unreferenced page out of the
+    # window. After a whole turn without one it takes the oldest page it went over
+    # The pages of a shared frame are checked in the tables of all the processes sharing it
+
+    def __init__(self, memory_manager, window=50):
+        super().__init__(memory_manager, window)
+        self._frames_used = [None] * memory_manager.frames.frames_number
+        self._hand = 0
 
     @property
     def frames_used(self):
         return self._frames_used
 
-    def add_frame(self, frame, page_info):
-        self.frames_used.append((frame, page_info))
+    @property
+    def hand(self):
+        return self._hand
+
+    def add_frame(self, frame, table, page, pid):
+        super().add_frame(frame, table, page, pid)
+        self._frames_used[frame] = (table, page)
+
+    def remove_frame(self, frame):
+        self._frames_used[frame] = None
+        return super().remove_frame(frame)
+
+    def working_set_size(self, pid):
+        now = self._clock.tickNbr
+        size = 0
+        for frame, owner in self._owners.items():
+            if owner == pid:
+                entries = self.memory_manager.frame_entries(frame)
+                if any(table.is_referenced(page) for table, page in entries) or \
+                        now - self.frame_timestamp(frame) <= self.window:
+                    size += 1
+        return size
 
     def get_victim(self):
+        now = self._clock.tickNbr
+        frames_used = self._frames_used
+        hand = self._hand
         victim = None
-        victimChosen = False
-        log.logger.info("El metodo recien empieza")
-        log.logger.info("La lista esta: " + str(self.frames_used))
-        while not victimChosen:
-            pair = self.frames_used.pop(0)
-            page_info = pair[1]
-            log.logger.info("Analizando " + str(pair))
-            if (not victimChosen) & (page_info[3] == 0):
-                log.logger.info("Encontre una victima")
-                victim = pair[0]
-                victimChosen = True
-                page_info[3] = 1
-                log.logger.info("victimChosen quedo en " + str(victimChosen))
-                log.logger.info("La lista quedo " + str(self.frames_used))
-            if (not victimChosen) & (page_info[3] == 1):
-                log.logger.info("Este no es una victima")
-                page_info[3] = 0
-                self.frames_used.append(pair)
-                log.logger.info("La lista quedo " + str(self.frames_used))
-            log.logger.info("Pasando al siguiente elemento de la lista")
-        log.logger.info("El metodo termino, la victima elegida es " + str(victim))
-        log.logger.info("La lista quedo " + str(self.frames_used))
+        oldest = None
+        oldest_time = None
+        for step in range(len(frames_used)):
+            frame = hand
+            entry = frames_used[frame]
+            hand += 1
+            if hand == len(frames_used):
+                hand = 0
+            if entry is None:
+                continue
+            if self.clear_frame_reference(frame):
+                self.set_frame_timestamp(frame, now)
+            elif now - self.frame_timestamp(frame) > self.window:
+                victim = frame
+                break
+            timestamp = self.frame_timestamp(frame)
+            if oldest is None or timestamp < oldest_time:
+                oldest = frame
+                oldest_time = timestamp
+        if victim is None:
+            victim = oldest
+        self._hand = hand
+        self.remove_frame(victim)
+        if log.enabled:
+            log.logger.info("La victima elegida es %s, la aguja quedo en %s", victim, hand)
         return victim
 
     def __repr__(self):
-        return "SECOND CHANCE MEMORY ALGORITHM\n{frames}".format(frames=self.frames_used)
+        return "WSCLOCK MEMORY ALGORITHM\nWindow: {window}\nHand: {hand}\n{frames}"\
+            .format(window=self.window, hand=self.hand, frames=self.frames_used)
 
 
-class PageTable:
+# Inverted page table: the owner (pid, page) of every used frame of the memory and of the swap
+# The memory managers keep it in sync, so finding the owner of a frame doesn't scan the page tables
+class InvertedPageTable:
+    # A frame can have many owners (a shared page), the first one is the owner followed by the page
+    # replacement algorithm
 
     def __init__(self):
-        self._page_list = {}
+        self._frames = {}
+        self._swap_frames = {}
+
+    @property
+    def frames(self):
+        return self._frames
 
     @property
-    def page_list(self):
-        return self._page_list
+    def swap_frames(self):
+        return self._swap_frames
+
+    def map(self, frame, pid, page, in_swap=False):
+        self.__entries(in_swap).setdefault(frame, []).append((pid, page))
+
+    # removes every owner of the frame and returns them
+    def unmap(self, frame, in_swap=False):
+        return self.__entries(in_swap).pop(frame, [])
+
+    # removes an owner of the frame and returns the owners left
+    def unmap_owner(self, frame, pid, page, in_swap=False):
+        entries = self.__entries(in_swap)
+        owners = entries.get(frame, [])
+        if (pid, page) in owners:
+            owners.remove((pid, page))
+        if not owners:
+            entries.pop(frame, None)
+        return owners
+
+    def owner(self, frame, in_swap=False):
+        owners = self.__entries(in_swap).get(frame)
+        if owners:
+            return owners[0]
+        return None
+
+    def owners(self, frame, in_swap=False):
+        return self.__entries(in_swap).get(frame, [])
+
+    def __entries(self, in_swap):
+        if in_swap:
+            return self._swap_frames
+        return self._frames
+
+    def __repr__(self):
+        return "INVERTED PAGE TABLE\nMemory: {frames}\nSwap: {swap}"\
+            .format(frames=self._frames, swap=self._swap_frames)
 
-    @page_list.setter
-    def page_list(self, new_list):
-        self._page_list = new_list
 
-    def add(self, page, frame):
-        self._page_list[page] = [frame, False, None, None]
+# Page table of a process: the entries of its pages in parallel arrays indexed by page number
+# (frame, in swap flag, timestamp, reference and dirty bits), a page never loaded has NO_FRAME
+# The frame of a page in swap is its swap frame
+NO_FRAME = -1
+# memory taken by a page entry (frame, timestamp, in swap flag, reference and dirty bits) and by a directory entry
+PAGE_ENTRY_BYTES = 2 * array('l').itemsize + 3
+DIRECTORY_ENTRY_BYTES = struct.calcsize('P')
 
-    def clone(self):
-        res = PageTable()
-        res.page_list = self.page_list
-        return res
+
+class PageTable:
+
+    def __init__(self, pages_number):
+        self._frames = array('l', [NO_FRAME]) * pages_number
+        self._in_swap = bytearray(pages_number)
+        self._timestamps = array('l', [0]) * pages_number
+        self._references = bytearray(pages_number)
+        self._dirty = bytearray(pages_number)
+
+    @property
+    def pages_number(self):
+        return len(self._frames)
+
+    def pages(self):
+        return range(0, len(self._frames))
+
+    # pages in memory and their frames
+    def loaded_pages(self):
+        for page, frame in enumerate(self._frames):
+            if frame != NO_FRAME and not self._in_swap[page]:
+                yield page, frame
+
+    # pages in swap and their swap frames
+    def swapped_pages(self):
+        for page, frame in enumerate(self._frames):
+            if self._in_swap[page]:
+                yield page, frame
 
     def page_is_loaded(self, page_number):
-        page_info = self.page_list[page_number]
-        return (page_info[0] is not None) & (not page_info[1])
+        return self._frames[page_number] != NO_FRAME and not self._in_swap[page_number]
 
     def update(self, page, frame):
-        page_info = self.page_list[page]
-        page_info[0] = frame
+        self._frames[page] = frame
+
+    # the page is no longer in memory nor in swap, as if it was never loaded
+    def unload(self, page):
+        self._frames[page] = NO_FRAME
+        self._in_swap[page] = 0
+        self._dirty[page] = 0
 
     def find_frame(self, page):
-        page_info = self.page_list[page]
-        return page_info[0]
-
-    def set_swap(self, frame, boolean):
-        for key, value in self.page_list.items():
-            if value[0] == frame:
-                value[1] = boolean
-
-    def owns_frame(self, frame_number):
-        res = False
-        for key, value in self.page_list.items():
-            if value[0] == frame_number & (not value[1]):
-                res = True
-        return res
-
-    def set_new_frame(self, old_frame, new_frame):
-        for key, value in self.page_list.items():
-            if value[0] == old_frame & value[1]:
-                value[0] = new_frame
+        frame = self._frames[page]
+        if frame == NO_FRAME:
+            return None
+        return frame
+
+    def is_in_swap(self, page):
+        return self._in_swap[page] == 1
+
+    def set_swap(self, page, boolean):
+        self._in_swap[page] = boolean
+
+    def timestamp(self, page):
+        return self._timestamps[page]
+
+    def set_timestamp(self, page, tick):
+        self._timestamps[page] = tick
+
+    def is_referenced(self, page):
+        return self._references[page] == 1
+
+    def reference(self, page):
+        self._references[page] = 1
+
+    def clear_reference(self, page):
+        self._references[page] = 0
+
+    # the page was modified since it was loaded
+    def is_dirty(self, page):
+        return self._dirty[page] == 1
+
+    def set_dirty(self, page):
+        self._dirty[page] = 1
+
+    def clear_dirty(self, page):
+        self._dirty[page] = 0
 
     def reset(self):
-        for key, value in self.page_list.items():
-            value[0] = None
-            value[1] = False
-            value[2] = None
-            value[3] = None
+        pages_number = len(self._frames)
+        self._frames = array('l', [NO_FRAME]) * pages_number
+        self._in_swap = bytearray(pages_number)
+        self._timestamps = array('l', [0]) * pages_number
+        self._references = bytearray(pages_number)
+        self._dirty = bytearray(pages_number)
+
+    def footprint(self):
+        size = len(self._frames) * PAGE_ENTRY_BYTES
+        return {"levels": 1, "directories": 0, "leaves": 1, "entries": len(self._frames), "bytes": size,
+                "peak_bytes": size}
+
+    def __repr__(self):
+        string = ""
+        for page in self.pages():
+            entry = [self.find_frame(page), self.is_in_swap(page), self.timestamp(page), self._references[page]]
+            string = string + "   " + "Page " + str(page) + ": " + str(entry)
+        return "{list} ".format(list=string)
+
+
+# Hierarchical page table with the interface of PageTable: the page number is split in an index for every level
+# (index_bits bits each, the top level takes the rest). At first only the top directory exists, the lower
+# directories and the leaves (PageTables of 2 ** index_bits entries) are allocated on the first write to one of
+# their pages. A page without a leaf reads as a page never loaded
+class MultiLevelPageTable:
+
+    def __init__(self, pages_number, levels=2, index_bits=6):
+        self._pages_number = pages_number
+        self._levels = levels
+        self._index_bits = index_bits
+        self._mask = (1 << index_bits) - 1
+        self._top_shift = index_bits * (levels - 1)
+        # shifts of the directories below the top one
+        self._lower_shifts = [index_bits * level for level in range(levels - 2, 0, -1)]
+        self._root = [None] * max(1, -(-pages_number >> self._top_shift))
+        self._directories = 1
+        self._leaves = 0
+        self._peak_bytes = self.bytes()
+
+    @property
+    def pages_number(self):
+        return self._pages_number
+
+    @property
+    def levels(self):
+        return self._levels
+
+    def pages(self):
+        return range(0, self._pages_number)
+
+    # the leaf of the page, None if it was never written
+    def _leaf(self, page):
+        node = self._root[page >> self._top_shift]
+        for shift in self._lower_shifts:
+            if node is None:
+                return None
+            node = node[(page >> shift) & self._mask]
+        return node
+
+    # the leaf of the page, allocating it (and its directories) on the first write
+    def _touch_leaf(self, page):
+        directory = self._root
+        index = page >> self._top_shift
+        for shift in self._lower_shifts:
+            node = directory[index]
+            if node is None:
+                node = [None] * (1 << self._index_bits)
+                directory[index] = node
+                self._directories += 1
+            directory = node
+            index = (page >> shift) & self._mask
+        leaf = directory[index]
+        if leaf is None:
+            leaf = PageTable(1 << self._index_bits)
+            directory[index] = leaf
+            self._leaves += 1
+            self._peak_bytes = max(self._peak_bytes, self.bytes())
+        return leaf
+
+    # (first page, leaf) of every allocated leaf
+    def _allocated_leaves(self):
+        nodes = deque([(index << self._top_shift, node, 0) for index, node in enumerate(self._root)])
+        while nodes:
+            base, node, depth = nodes.popleft()
+            if node is None:
+                continue
+            if depth == len(self._lower_shifts):
+                yield base, node
+            else:
+                shift = self._lower_shifts[depth]
+                nodes.extend([(base + (index << shift), child, depth + 1) for index, child in enumerate(node)])
+
+    def loaded_pages(self):
+        for base, leaf in self._allocated_leaves():
+            for page, frame in leaf.loaded_pages():
+                yield base + page, frame
+
+    def swapped_pages(self):
+        for base, leaf in self._allocated_leaves():
+            for page, frame in leaf.swapped_pages():
+                yield base + page, frame
+
+    def page_is_loaded(self, page_number):
+        leaf = self._leaf(page_number)
+        return leaf is not None and leaf.page_is_loaded(page_number & self._mask)
+
+    def update(self, page, frame):
+        self._touch_leaf(page).update(page & self._mask, frame)
+
+    def unload(self, page):
+        leaf = self._leaf(page)
+        if leaf is not None:
+            leaf.unload(page & self._mask)
+
+    def find_frame(self, page):
+        leaf = self._leaf(page)
+        if leaf is None:
+            return None
+        return leaf.find_frame(page & self._mask)
+
+    def is_in_swap(self, page):
+        leaf = self._leaf(page)
+        return leaf is not None and leaf.is_in_swap(page & self._mask)
+
+    def set_swap(self, page, boolean):
+        self._touch_leaf(page).set_swap(page & self._mask, boolean)
+
+    def timestamp(self, page):
+        leaf = self._leaf(page)
+        if leaf is None:
+            return 0
+        return leaf.timestamp(page & self._mask)
+
+    def set_timestamp(self, page, tick):
+        self._touch_leaf(page).set_timestamp(page & self._mask, tick)
+
+    def is_referenced(self, page):
+        leaf = self._leaf(page)
+        return leaf is not None and leaf.is_referenced(page & self._mask)
+
+    def reference(self, page):
+        self._touch_leaf(page).reference(page & self._mask)
+
+    def clear_reference(self, page):
+        self._touch_leaf(page).clear_reference(page & self._mask)
+
+    def is_dirty(self, page):
+        leaf = self._leaf(page)
+        return leaf is not None and leaf.is_dirty(page & self._mask)
+
+    def set_dirty(self, page):
+        self._touch_leaf(page).set_dirty(page & self._mask)
+
+    def clear_dirty(self, page):
+        self._touch_leaf(page).clear_dirty(page & self._mask)
+
+    # the leaves and the lower directories are dropped
+    def reset(self):
+        self._root = [None] * len(self._root)
+        self._directories = 1
+        self._leaves = 0
+
+    def bytes(self):
+        directory_slots = len(self._root) + (self._directories - 1) * (1 << self._index_bits)
+        return self._leaves * (1 << self._index_bits) * PAGE_ENTRY_BYTES + directory_slots * DIRECTORY_ENTRY_BYTES
+
+    def footprint(self):
+        return {"levels": self._levels, "directories": self._directories, "leaves": self._leaves,
+                "entries": self._leaves * (1 << self._index_bits), "bytes": self.bytes(),
+                "peak_bytes": self._peak_bytes}
 
     def __repr__(self):
         string = ""
-        for key, value in self.page_list.items():
-            string = string + "   " + "Page " + str(key) + ": " + str(value)
+        for base, leaf in self._allocated_leaves():
+            for page in leaf.pages():
+                entry = [leaf.find_frame(page), leaf.is_in_swap(page), leaf.timestamp(page), leaf.is_referenced(page)]
+                string = string + "   " + "Page " + str(base + page) + ": " + str(entry)
         return "{list} ".format(list=string)